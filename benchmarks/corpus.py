@@ -0,0 +1,46 @@
+import datetime
+import os
+import random
+
+WORDS = (
+  'the of and to in is for on with as by at from this that it be are or an '
+  'python docker compose server request query index cache file entry tag '
+  'graph node edge tree list dict set heap queue stack vector matrix model '
+  'train test data loss error value key time date year month day week book '
+  'read write load save parse token word search rank score link page note'
+).split()
+
+# Generates a synthetic jmfveneroso.txt corpus. Tags form a tree with the
+# given depth and fan-out, and entries are spread uniformly across tags.
+def generate_corpus(path, num_entries=10000, content_lines=5,
+                    line_length=12, tag_depth=3, fanout=4, seed=0):
+  rnd = random.Random(seed)
+
+  tag_names = []
+  next_tag_id = [2]
+  def write_tags(f, depth, prefix):
+    if depth == tag_depth:
+      return
+    for i in range(fanout):
+      name = '%s%d' % (prefix, i)
+      f.write('  ' * depth + name + ' ' + str(next_tag_id[0]) + '\n')
+      tag_names.append(name)
+      next_tag_id[0] += 1
+      write_tags(f, depth + 1, name + '-')
+
+  date = datetime.datetime(2015, 1, 1)
+  with open(path, 'w') as f:
+    write_tags(f, 0, 't')
+    f.write('\n')
+
+    for entry_id in range(1, num_entries + 1):
+      date += datetime.timedelta(seconds=rnd.randint(60, 36000))
+      title = ' '.join(rnd.choice(WORDS) for _ in range(4)).capitalize()
+      tag = rnd.choice(tag_names) if tag_names else 'other'
+      f.write('K%08d [%s|%s] (%s) %s\n\n' % (
+        entry_id, date.strftime('%Y-%m-%d %H:%M:%S'),
+        date.strftime('%Y-%m-%d %H:%M:%S'), tag, title))
+      for _ in range(content_lines):
+        f.write(' '.join(rnd.choice(WORDS) for _ in range(line_length)) + '\n')
+      f.write('\n')
+  return os.path.getsize(path)
@@ -0,0 +1,67 @@
+import argparse
+import gc
+import tempfile
+import tracemalloc
+from benchmarks.corpus import generate_corpus
+from logger import jlogger
+from logger.entry import Entry
+from logger.util import epoch_to_date
+
+# Layout of Entry before it used __slots__: attributes in a per-instance dict,
+# datetime timestamps and a direct reference to the category Tag.
+class DictEntry:
+  def __init__(self, entry_id, created_at, modified_at, title, category,
+               content, line_num):
+    self.id = entry_id
+    self.created_at = created_at
+    self.modified_at = modified_at
+    self.title = title
+    self.category = category
+    self.content = content
+    self.line_num = line_num
+
+def measure(fn):
+  gc.collect()
+  tracemalloc.start()
+  result = fn()
+  size = tracemalloc.get_traced_memory()[0]
+  tracemalloc.stop()
+  return result, size
+
+# Builds one object per entry of the logger with each layout, reusing the
+# strings and content lists, so only the per-entry overhead is measured.
+def entry_overhead(logger):
+  entries = list(logger.entries_by_id.values())
+  def build_dict_entries():
+    return [DictEntry(e.id, epoch_to_date(e.created_ts),
+                      epoch_to_date(e.modified_ts), e.title, e.category,
+                      e._content, e.line_num) for e in entries]
+  def build_slot_entries():
+    return [Entry(e.id, e.created_ts, e.modified_ts, e.title, e.category_id,
+                  e._content, e.line_num, logger) for e in entries]
+
+  _, dict_size = measure(build_dict_entries)
+  _, slot_size = measure(build_slot_entries)
+  return dict_size / len(entries), slot_size / len(entries)
+
+def main():
+  argparser = argparse.ArgumentParser(prog='memory_report')
+  argparser.add_argument('-n', '--entries', type=int, default=200000)
+  args = argparser.parse_args()
+
+  with tempfile.TemporaryDirectory() as tmp:
+    jlogger.DATA_PATH = tmp
+    size = generate_corpus(jlogger.get_data_file(), num_entries=args.entries)
+    print('Corpus: %.1f MB, %d entries' % (size / (1024 * 1024), args.entries))
+
+    for name, kwargs in [('eager', {}), ('lazy', {'lazy': True})]:
+      logger, total = measure(lambda: jlogger.Logger(**kwargs))
+      print('Logger (%s): %.1f MB, %.0f bytes/entry' % (
+        name, total / (1024 * 1024), total / args.entries))
+
+    dict_overhead, slot_overhead = entry_overhead(logger)
+    print('Per-entry overhead: %.0f bytes before (dict, datetimes), '
+          '%.0f bytes after (slots, epoch ints)' % (dict_overhead, slot_overhead))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,34 @@
+import argparse
+import os
+import tempfile
+import time
+from benchmarks.corpus import generate_corpus
+from logger import jlogger
+from logger import parser
+
+# Reports parse throughput of the streaming parser and of a full Logger.load
+# over a synthetic corpus.
+def main():
+  argparser = argparse.ArgumentParser(prog='parse_throughput')
+  argparser.add_argument('-n', '--entries', type=int, default=100000)
+  argparser.add_argument('--file', type=str, help='existing corpus to parse')
+  args = argparser.parse_args()
+
+  with tempfile.TemporaryDirectory() as tmp:
+    path = args.file
+    if path is None:
+      path = os.path.join(tmp, jlogger.FILENAME)
+      generate_corpus(path, num_entries=args.entries)
+
+    size = os.path.getsize(path) / (1024 * 1024)
+    num_entries, mbs = parser.measure_throughput(path)
+    print('Corpus: %.1f MB, %d entries' % (size, num_entries))
+    print('parser:       %8.2f MB/s' % mbs)
+
+    jlogger.DATA_PATH, jlogger.FILENAME = os.path.split(path)
+    start = time.perf_counter()
+    jlogger.Logger()
+    print('Logger.load:  %8.2f MB/s' % (size / (time.perf_counter() - start)))
+
+if __name__ == '__main__':
+  main()
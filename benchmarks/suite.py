@@ -0,0 +1,277 @@
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+from collections import Counter
+from benchmarks.corpus import generate_corpus
+from logger import jlogger
+from logger import querycache
+from logger import search
+from logger.entry import tokenize
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             'baseline.json')
+
+# Each scenario takes a loaded Logger and returns a function running the
+# timed operation once. Setup done outside that function is not timed.
+
+def bench_load(logger):
+  return lambda: jlogger.Logger(workers=1)
+
+def bench_save(logger):
+  def save():
+    entry = logger.create_entry('Benchmark entry', 1)
+    logger.edit_entry({'id': entry.id, 'content': 'Benchmark content'})
+    logger.save()
+  return save
+
+def bench_compact(logger):
+  return logger.compact
+
+def bench_get_entries(logger):
+  return logger.get_entries
+
+def bench_tag_get_entries(logger):
+  def get_entries():
+    for t in logger.get_tags():
+      t.get_entries()
+  return get_entries
+
+# Same payload as the /all/ view.
+def bench_to_json_all(logger):
+  return lambda: json.dumps({
+    'tags': [t.to_json() for t in logger.get_tags()],
+    'entries': [e.to_json() for e in logger.get_entries()],
+  })
+
+def count_tokens(entries):
+  counter = Counter()
+  for e in entries:
+    counter.update(e.get_tokens())
+  return counter
+
+# The search command's scoring loop before the search index, the baseline of
+# the index scenarios below. Scores entries by the inverse squared frequency
+# of the query tokens they contain, normalized by that of all their tokens.
+# Returns [score, entry] pairs with a positive score, best first. Ties keep
+# the order of entries.
+def score_entries(entries, tokens, vocab):
+  token_set = set(tokens)
+  scored_entries = []
+  for e in entries:
+    score = 0
+    norm = 0
+    for w in e.get_tokens():
+      if w in vocab:
+        if w in token_set:
+          score += (1.0 / vocab[w]) ** 2
+        norm += (1.0 / vocab[w]) ** 2
+
+    if norm > 0.0:
+      score /= math.sqrt(norm)
+    if score > 0.0:
+      scored_entries.append([score, e])
+
+  return sorted(scored_entries, key=lambda e: e[0], reverse=True)
+
+def bench_search(logger):
+  entries = logger.get_entries()
+  vocab = count_tokens(entries)
+  tokens = ['python', 'index', 'cache']
+  return lambda: score_entries(reversed(entries), tokens, vocab)
+
+# Query against an up to date index, as the search command runs it.
+def bench_search_index(logger):
+  index = search.SearchIndex(search.get_index_file(jlogger.get_data_file()))
+  index.sync(logger)
+  return lambda: index.query(['python', 'index', 'cache'])
+
+# First page of the same query, as the interactive pager fetches it.
+def bench_search_top_k(logger):
+  index = search.SearchIndex(search.get_index_file(jlogger.get_data_file()))
+  index.sync(logger)
+  return lambda: index.query(['python', 'index', 'cache'], k=10)
+
+# The same page ranked by the inverse frequency score.
+def bench_search_inverse_frequency(logger):
+  index = search.SearchIndex(search.get_index_file(jlogger.get_data_file()))
+  index.sync(logger)
+  return lambda: index.query_inverse_frequency(['python', 'index', 'cache'],
+                                               k=10)
+
+# The same page repeated by a later CLI invocation, from the disk tier of
+# the query cache.
+def bench_search_cached(logger):
+  index = search.SearchIndex(search.get_index_file(jlogger.get_data_file()))
+  index.sync(logger)
+  path = querycache.get_cache_file(jlogger.get_data_file())
+  terms = ['python', 'index', 'cache']
+  key = ('bm25', None, tuple(('term', (t,), None) for t in terms), 10)
+  def run():
+    with querycache.QueryCache(path=path) as cache:
+      return cache.get_or_compute(
+        logger, key, lambda: index.query(terms, k=10))
+  run()
+  return run
+
+def bench_correct(logger):
+  index = search.SearchIndex(search.get_index_file(jlogger.get_data_file()))
+  index.sync(logger)
+  words = ['pyhton', 'indx', 'cahce', 'serch']
+  return lambda: [index.correct(w) for w in words]
+
+# Tokenizing every entry from scratch and reading the cached tokens. main
+# reports both as tokens per second.
+def bench_tokenize(logger):
+  texts = ['\n'.join([e.title] + e.content) for e in logger.get_entries()]
+  return lambda: [tokenize(t) for t in texts]
+
+def bench_get_tokens(logger):
+  entries = logger.get_entries()
+  for e in entries:
+    e.get_tokens()
+  return lambda: [e.get_tokens() for e in entries]
+
+# Entry counts of the vocab command, read from an up to date index.
+def bench_vocab(logger):
+  index = search.SearchIndex(search.get_index_file(jlogger.get_data_file()))
+  index.sync(logger)
+  return index.get_vocab
+
+SCENARIOS = [
+  ('load', bench_load),
+  ('save', bench_save),
+  ('compact', bench_compact),
+  ('get_entries', bench_get_entries),
+  ('tag_get_entries', bench_tag_get_entries),
+  ('to_json_all', bench_to_json_all),
+  ('search', bench_search),
+  ('search_index', bench_search_index),
+  ('search_top_k', bench_search_top_k),
+  ('search_inverse_frequency', bench_search_inverse_frequency),
+  ('search_cached', bench_search_cached),
+  ('correct', bench_correct),
+  ('tokenize', bench_tokenize),
+  ('get_tokens', bench_get_tokens),
+  ('vocab', bench_vocab),
+]
+
+THROUGHPUT_SCENARIOS = ('tokenize', 'get_tokens')
+
+# Returns the best of repeat runs of fn in seconds.
+def best_time(fn, repeat):
+  times = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    fn()
+    times.append(time.perf_counter() - start)
+  return min(times)
+
+# Runs the scenarios matching names (all if empty) over a corpus generated
+# with corpus_args in a temporary directory.
+def run(corpus_args, repeat=3, names=()):
+  orig_data_path = jlogger.DATA_PATH
+  with tempfile.TemporaryDirectory() as tmp:
+    jlogger.DATA_PATH = tmp
+    try:
+      size = generate_corpus(jlogger.get_data_file(), **corpus_args)
+      results = {}
+      for name, scenario in SCENARIOS:
+        if names and name not in names:
+          continue
+        # Each scenario gets a fresh logger, as some of them write.
+        fn = scenario(jlogger.Logger(workers=1))
+        results[name] = best_time(fn, repeat)
+      num_tokens = sum(len(e.get_tokens())
+                       for e in jlogger.Logger(workers=1).get_entries())
+    finally:
+      jlogger.DATA_PATH = orig_data_path
+
+  return {
+    'python': platform.python_version(),
+    'corpus': dict(corpus_args, size=size, tokens=num_tokens),
+    'results': results,
+  }
+
+# Returns (name, baseline, current, change in percent) for each scenario in
+# both reports whose change is above max_regression percent.
+def compare(baseline, report, max_regression):
+  regressions = []
+  for name, current in sorted(report['results'].items()):
+    previous = baseline['results'].get(name)
+    if not previous:
+      continue
+    change = (current - previous) / previous * 100
+    if change > max_regression:
+      regressions.append((name, previous, current, change))
+  return regressions
+
+def main():
+  argparser = argparse.ArgumentParser(prog='suite')
+  argparser.add_argument('-n', '--entries', type=int, default=20000)
+  argparser.add_argument('--content-lines', type=int, default=5)
+  argparser.add_argument('--line-length', type=int, default=12)
+  argparser.add_argument('--tag-depth', type=int, default=3)
+  argparser.add_argument('--fanout', type=int, default=4)
+  argparser.add_argument('-r', '--repeat', type=int, default=3)
+  argparser.add_argument('-s', '--scenario', action='append', default=[],
+                         help='scenario to run, all by default')
+  argparser.add_argument('-o', '--output', type=str,
+                         help='file to write the results to')
+  argparser.add_argument('--baseline', type=str, default=BASELINE_FILE)
+  argparser.add_argument('--save-baseline', action='store_true',
+                         help='store the results as the new baseline')
+  argparser.add_argument('--max-regression', type=float, default=20,
+                         help='slowdown in percent that fails the run')
+  args = argparser.parse_args()
+
+  corpus_args = {
+    'num_entries': args.entries,
+    'content_lines': args.content_lines,
+    'line_length': args.line_length,
+    'tag_depth': args.tag_depth,
+    'fanout': args.fanout,
+  }
+  report = run(corpus_args, args.repeat, args.scenario)
+
+  baseline = None
+  if not args.save_baseline and os.path.isfile(args.baseline):
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+    if baseline['corpus'] != report['corpus']:
+      print('Baseline was measured on a different corpus, ignoring it')
+      baseline = None
+
+  for name, seconds in report['results'].items():
+    line = '%-24s %9.2f ms' % (name, seconds * 1000)
+    previous = baseline['results'].get(name) if baseline else None
+    if previous:
+      line += '  %+7.1f%%' % ((seconds - previous) / previous * 100)
+    if name in THROUGHPUT_SCENARIOS:
+      line += '  %.2fM tokens/s' % (report['corpus']['tokens'] / seconds / 1e6)
+    print(line)
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(report, f, indent=2)
+
+  if args.save_baseline:
+    with open(args.baseline, 'w') as f:
+      json.dump(report, f, indent=2)
+    return 0
+
+  if baseline is not None:
+    regressions = compare(baseline, report, args.max_regression)
+    for name, previous, current, change in regressions:
+      print('%s regressed by %.1f%% (%.2f ms -> %.2f ms)' % (
+        name, change, previous * 1000, current * 1000))
+    if regressions:
+      return 1
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
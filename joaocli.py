@@ -4,6 +4,11 @@ import argparse
 import datetime
 import file_syncer
 from logger import jlogger
+from logger import journal
+from logger import querycache
+from logger import search as search_index
+from logger import shards
+from logger.entry import tokenize
 import glob
 import io
 import json
@@ -52,7 +57,15 @@ def load_config():
   with open(dir_path + '/config.json') as json_file:
     config = json.load(json_file)
 
+def compact():
+  if journal.size(jlogger.get_data_file()) > 0:
+    jlogger.Logger().compact()
+
+# The remote only holds the single data file, which a sharded corpus lacks.
 def sync(dry_run, verbose):
+  if shards.is_sharded(jlogger.get_shards_dir()):
+    raise Exception('Cannot sync a sharded corpus, run unshard first')
+  compact()
   storage = file_syncer.S3Wrapper('public')
   fsyncer = file_syncer.FileSyncer(
     storage,
@@ -81,9 +94,9 @@ def load_knowledge():
 
 def get_titles():
   titles = {}
-  logger = jlogger.Logger()
-  for e in logger.entries:
-    titles[e.title] = e
+  logger = jlogger.Logger(use_snapshot=True, lazy=True)
+  for e in logger.get_entries():
+    titles[e.title.strip()] = e
   return titles
 
 def get_chronos():
@@ -94,7 +107,7 @@ def view_titles():
   titles = get_titles()
   for t in titles:
     e = titles[t]
-    dt = datetime.datetime.strftime(e.timestamp, '%Y-%m-%d %H:%M:%S')
+    dt = datetime.datetime.strftime(e.modified_at, '%Y-%m-%d %H:%M:%S')
     print(e.id, dt, t)
 
 def view_chronos():
@@ -103,8 +116,21 @@ def view_chronos():
     print(c)
 
 def view_log(n):
-  logger = jlogger.Logger()
-  print_entries(logger.get_entries(), n)
+  n = 10 if (n is None) else n
+  logger = jlogger.Logger(use_snapshot=True, lazy=True, latest=n)
+  entries, _ = logger.get_latest_entries(n)
+  for e in entries:
+    e.print_summarized()
+
+# Prints the entries created (or modified) between two YYYY-MM-DD dates,
+# newest first, at most n if given.
+def view_range(since, until, field, n):
+  since = datetime.datetime.strptime(since, '%Y-%m-%d') if since else None
+  until = datetime.datetime.strptime(until, '%Y-%m-%d') if until else None
+  logger = jlogger.Logger(use_snapshot=True, lazy=True)
+  entries = logger.get_entries_between(since, until, field)
+  for e in reversed(entries[-n:] if n else entries):
+    e.print_summarized()
 
 def process_knowledge_piece(q):
   knowledge_pieces = load_knowledge()
@@ -135,21 +161,20 @@ def process_knowledge_piece(q):
   return True
 
 def vocab():
-  words = []
+  texts = []
   kps = load_knowledge()
   for key in kps:
-    words += jlogger.tokenize(key)
-    words += jlogger.tokenize(kps[key]['text'])
+    texts += [key, kps[key]['text']]
 
-  logger = jlogger.Logger()
-  for e in logger.entries:
-    words += e.get_tokens()
-  words = [w for w in words]
+  counter = Counter()
+  for t in texts:
+    counter.update(tokenize(t))
 
-  with open(os.path.join(data_path, 'vocab.txt'), 'w') as f:
-    counter = Counter(words)
-    for w in counter.most_common():
-      f.write(w[0] + ' ' + str(w[1]) + '\n')
+  # Entry counts are the collection frequencies kept by the search index.
+  logger = jlogger.Logger(use_snapshot=True, lazy=True)
+  with open_search_index(logger) as index:
+    counter.update(index.get_vocab())
+  search_index.write_vocab(os.path.join(data_path, 'vocab.txt'), counter)
 
 def seconds_since_midnight(date):
   midnight = date.replace(hour=0, minute=0, second=0, microsecond=0)
@@ -208,48 +233,17 @@ def print_chrono(chrono):
   for l in reversed(lines):
     print(l)
 
-def get_levenshtein_distance(w1, w2):
-  memo = [i for i in range(len(w1) + 1)]
-  memo2 = [0 for _ in range(len(w1) + 1)]
-
-  for j in range(len(w2)):
-    memo2[0] = j
-    for i in range(len(w1)):
-      min_val = memo[i] + (0 if w1[i] == w2[j] else 1)
-      min_val = min(min_val, memo[i+1] + 1)
-      min_val = min(min_val, memo2[i] + 1)
-      memo2[i+1] = min_val
-    memo = memo2.copy()
-  return memo[len(w1)]
-
-def get_closest_word(w, vocab):
-  if w in vocab:
-    return w
-
-  min_word = None
-  min_distance = 100
-  for w2 in vocab:
-    if abs(len(w2) - len(w)) > min_distance:
-      continue
-
-    dis = get_levenshtein_distance(w, w2)
-    if dis < min_distance:
-      min_distance = dis
-      min_word = w2
-
-  return min_word
-
 def try_exact_match(logger, q):
   try:
-    e = logger.get_log_entry_by_id(int(q))
+    e = logger.entries_by_id.get(int(q))
     if e:
       e.print_detailed()
       return True
   except ValueError:
     pass
 
-  if q in logger.tags:
-    logger.tags[q].print_detailed()
+  if q in logger.tags_by_name:
+    logger.tags_by_name[q].print_detailed()
     return True
 
   # TODO: fix chrono.
@@ -259,56 +253,88 @@ def try_exact_match(logger, q):
 
   return False
 
-def search(q, show_all=False):
-  logger = jlogger.Logger()
-
-  v = jlogger.load_vocab()
-  tkns = jlogger.tokenize(q)
+# Opens the search index of the data file, bringing it up to date with
+# logger if given.
+def open_search_index(logger=None):
+  index = search_index.SearchIndex(
+    search_index.get_index_file(jlogger.get_data_file()))
+  if logger is not None:
+    index.sync(logger)
+  return index
+
+# Search results are cached next to the data file, so repeated queries
+# skip scoring.
+def open_query_cache():
+  return querycache.QueryCache(
+    path=querycache.get_cache_file(jlogger.get_data_file()))
+
+def reindex():
+  path = search_index.get_index_file(jlogger.get_data_file())
+  if os.path.isfile(path):
+    os.remove(path)
+  logger = jlogger.Logger(use_snapshot=True)
+  with open_search_index(logger) as index:
+    num_docs, _ = index.get_totals()
+  print('Indexed %d entries' % num_docs)
+
+def search(q, show_all=False, rank='bm25'):
+  # Content is only read for the entries that are reindexed or shown.
+  logger = jlogger.Logger(use_snapshot=True, lazy=True)
+
+  tkns = tokenize(q)
 
   if len(tkns) == 1:
     if try_exact_match(logger, tkns[0].lower()):
       return
 
-  if tkns[0] in logger.tags:
-    entries = logger.tags[tkns[0]].get_entries()
-    tkns = tkns[1:]
-  else:
-    entries = logger.entries
-
-  tkns = [get_closest_word(t, v) for t in tkns]
-  tkn_set = { t for t in tkns }
-
-  scored_entries = []
-  for e in reversed(entries):
-    words = e.get_tokens()
-
-    score = 0
-    norm = 0
-    for w in words:
-      if w in v:
-        if w in tkn_set:
-          score += (1.0 / v[w]) ** 2
-        norm += (1.0 / v[w]) ** 2
-
-    if norm > 0.0:
-      score /= math.sqrt(norm)
-    scored_entries.append([score, e])
+  clauses = search_index.parse_query(q)
+
+  # The first word selects a tag if it is the exact name of one and there
+  # are more words to search for in it. Abbreviations are searched as
+  # words, since a word like "d" would otherwise silently narrow the query.
+  tag = None
+  if len(clauses) > 1 and clauses[0][0] == 'term':
+    tag = logger.tags_by_name.get(clauses[0][1][0])
+    if tag is not None:
+      clauses = clauses[1:]
+  entry_ids = None if tag is None else tag.get_entry_ids()
+
+  with open_search_index(logger) as index, open_query_cache() as cache:
+    # Single words are corrected, phrases and NEAR terms are matched as is.
+    corrected = []
+    for op, terms, arg in clauses:
+      if op == 'term':
+        terms = [index.correct(t) for t in terms]
+        if None in terms:
+          continue
+      corrected.append((op, tuple(terms), arg))
+    clauses = tuple(corrected)
+    tkns = [t for _, terms, _ in clauses for t in terms]
+
+    # Results are fetched a page at a time, as the pager reads them.
+    def fetch(k):
+      key = (rank, None if tag is None else tag.id, clauses, k)
+      results = cache.get_or_compute(logger, key, lambda: index.search(
+        clauses, entry_ids, search_index.TITLE_BOOST, k, rank))
+      return [[score, logger.entries_by_id[id]] for score, id in results]
+
+    if show_all:
+      scored_entries = fetch(None)
+    else:
+      scored_entries = search_index.LazyResults(fetch)
 
-  scored_entries = [e for e in scored_entries if e[0] > 0.0]
-  for i in range(len(scored_entries)):
-    e = scored_entries[i][1]
+    if len(scored_entries) == 0:
+      print("No results found")
+      return
 
-  scored_entries = sorted(scored_entries, key=lambda e : e[0], reverse=True)
+    if show_all:
+      for e in scored_entries:
+        e[1].print_summarized()
+      return
 
-  if len(scored_entries) == 0:
-    print("No results found")
-    return
-
-  if show_all:
-    for e in scored_entries:
-      e.print_summarized()
-    return
+    page_results(q, tkns, scored_entries)
 
+def page_results(q, tkns, scored_entries):
   global orig_settings
 
   cursor = 0
@@ -316,7 +342,9 @@ def search(q, show_all=False):
   while pressed_key != chr(27):
     subprocess.call('clear')
     print('Query:', bcolors.HEADER + q + bcolors.ENDC + ' ' + ' '.join(tkns))
-    print('Showing result %d of %d' % (cursor+1, len(scored_entries)))
+    print('Showing result %d of %d%s' % (
+      cursor+1, len(scored_entries),
+      '' if scored_entries.is_complete() else '+'))
     print()
 
     entry = scored_entries[cursor]
@@ -327,7 +355,7 @@ def search(q, show_all=False):
     termios.tcsetattr(sys.stdin, termios.TCSADRAIN, orig_settings)
 
     if pressed_key == 'j' or pressed_key == 13:
-      cursor = cursor + 1 if cursor < len(scored_entries) - 1 else cursor
+      cursor = cursor + 1 if scored_entries.has(cursor + 1) else cursor
     elif pressed_key == 'k':
       cursor = cursor - 1 if cursor > 0 else cursor
     elif pressed_key == chr(10):
@@ -343,9 +371,12 @@ def get_tags():
       tags.add(t)
   return tags
 
-def tags():
-  logger = jlogger.Logger()
+# Lists all tags, or those whose name starts with prefix.
+def tags(prefix=None):
+  logger = jlogger.Logger(use_snapshot=True, lazy=True)
   tags = logger.get_tags()
+  if prefix:
+    tags = [logger.get_tag_by_name(n) for n in logger.complete_tag_name(prefix)]
   for t in tags:
     dt = datetime.datetime.strftime(t.modified_at, "%Y-%m-%d %H:%M:%S")
     print("%s (%d): %s" % (t.name, len(t.entries), dt))
@@ -379,11 +410,12 @@ def backup():
 
 
 def overview(tag_name=None):
-  logger = jlogger.Logger()
+  logger = jlogger.Logger(use_snapshot=True, lazy=True,
+                          tags=[tag_name] if tag_name else None)
 
   tags = []
   if tag_name:
-    tags = logger.tags[tag_name].get_child_tags()
+    tags = logger.resolve_tag(tag_name).get_child_tags()
   else:
     tags = logger.get_tags()
 
@@ -400,10 +432,10 @@ def overview(tag_name=None):
 
 
 def stats():
-  logger = jlogger.Logger()
+  logger = jlogger.Logger(use_snapshot=True)
 
   token_counts = []
-  for e in logger.entries:
+  for e in logger.get_entries():
     num_tokens = len(e.get_tokens())
     token_counts.append(num_tokens)
 
@@ -421,31 +453,35 @@ def print_tag_hierarchy(tag, indents=0):
   for c in tag.children:
     print_tag_hierarchy(c, indents + 1)
 
-def print_entries(entries, n):
-  n = 10 if (n is None) else n
-  for e in reversed(entries):
-    e.print_summarized()
-    n -= 1
-    if n == 0:
-      break
+# Vim edits to a segment can change the shard an entry belongs to, so the
+# shards are rewritten afterwards.
+def refresh_shards(logger):
+  if logger.shards is not None:
+    jlogger.Logger().compact()
 
 def create_log_entry():
   logger = jlogger.Logger()
-  logger.create_entry('', 1)
-  logger.save()
+  entry = logger.create_entry('', 1)
+  logger.compact()
 
-  filename = os.path.join(DATA_PATH, FILENAME)
+  filename = logger.get_entry_file(entry)
   subprocess.run(['vim', '+normal G$', filename])
+  refresh_shards(logger)
 
 def edit_log_entry(id):
-  logger = jlogger.Logger()
+  logger = jlogger.Logger(use_snapshot=True, lazy=True)
   entry = logger.get_entry_by_id(id)
 
-  filename = os.path.join(DATA_PATH, FILENAME)
+  # Edits made in vim would be overwritten by the journal on the next load.
+  if journal.size(jlogger.get_data_file()) > 0:
+    logger.compact()
+
+  filename = logger.get_entry_file(entry)
   if not os.path.isfile(filename):
     raise ValueError(filename + ' does not exist')
 
   subprocess.run(['vim', '+normal %dgg$' % entry.line_num, filename])
+  refresh_shards(logger)
 
 def process_query(args):
   query = ' '.join(args.command)
@@ -487,10 +523,22 @@ def process_query(args):
     logger = jlogger.Logger()
     return logger.add_chrono(args.command[1], args.command[2])
 
+  if query == 'compact':
+    return compact()
+
+  if args.command[0] == 'shard':
+    by = args.command[1] if len(args.command) > 1 else 'tag'
+    return jlogger.Logger().convert(by)
+
+  if query == 'unshard':
+    return jlogger.Logger().convert()
+
   if query == 'log':
     return create_log_entry()
 
   if query == 'view':
+    if args.since or args.until:
+      return view_range(args.since, args.until, args.by, args.n)
     return view_log(args.n)
 
   if query == 'titles':
@@ -502,8 +550,11 @@ def process_query(args):
   if query == 'vocab':
     return vocab()
 
-  if query == 'tags':
-    return tags()
+  if query == 'reindex':
+    return reindex()
+
+  if args.command[0] == 'tags':
+    return tags(args.command[1] if len(args.command) > 1 else None)
 
   if query == 'bak':
     return backup()
@@ -521,7 +572,7 @@ def process_query(args):
     return stats()
 
   if query == 'hier':
-    logger = jlogger.Logger()
+    logger = jlogger.Logger(use_snapshot=True, lazy=True)
     return print_tag_hierarchy(logger.main_tag)
 
   if query == 'write':
@@ -533,17 +584,17 @@ def process_query(args):
     return logger.load('jmfveneroso.txt')
 
   if query == 'checkpoint':
-    titles = get_titles()
-    if 'Checkpoint' in titles:
-      entry = titles['Checkpoint']
-      text = ' ' .join(entry['text']).strip()
+    logger = jlogger.Logger(use_snapshot=True, lazy=True)
+    entries = logger.get_entries_by_title('Checkpoint')
+    if entries:
+      text = ' ' .join(entries[-1].content).strip()
       checkpoint_date = datetime.datetime.strptime(text, '%Y-%m-%d')
       days_to_checkpoint = abs(checkpoint_date - datetime.datetime.now()).days
       print('%d days remaining to the next checkpoint' % days_to_checkpoint)
     return
 
   if not process_knowledge_piece(query):
-    search(query, bool(args.all))
+    search(query, bool(args.all), args.rank)
 
 if __name__ == '__main__':
   load_config()
@@ -559,6 +610,12 @@ if __name__ == '__main__':
   parser.add_argument('-d', '--dry-run', action='store_true')
   parser.add_argument('-v', '--verbose', action='store_true')
   parser.add_argument('-n', type=int, help="number of entries to print")
+  parser.add_argument('--since', type=str, help="first date (YYYY-MM-DD) to view")
+  parser.add_argument('--until', type=str, help="date (YYYY-MM-DD) to view up to")
+  parser.add_argument('--by', choices=['created', 'modified'], default='created',
+                      help="date that --since and --until apply to")
+  parser.add_argument('--rank', choices=search_index.SCORERS, default='bm25',
+                      help="scoring function for search results")
   parser.add_argument('command', type=str, nargs='+', help='the main command')
 
   args = parser.parse_args()
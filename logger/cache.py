@@ -0,0 +1,73 @@
+import contextlib
+import threading
+from logger import jlogger
+
+# Process-wide Logger reused across requests. The data file is only parsed
+# again when its signature (inode, size, mtime) or the journal's changes on
+# disk, and writes go through the same instance so our own saves never force
+# a reload. Journal compaction runs on a background thread.
+class SharedLogger:
+  def __init__(self, factory=None):
+    self.factory = factory if factory is not None else jlogger.Logger
+    self.lock = threading.RLock()
+    self.logger = None
+    self.compacting = False
+
+  @contextlib.contextmanager
+  def acquire(self):
+    with self.lock:
+      if self.logger is None or self.logger.is_stale():
+        self.logger = self.factory()
+        self.logger.auto_compact = False
+
+      try:
+        yield self.logger
+      except Exception:
+        # A failed mutation may leave the instance half updated.
+        self.logger = None
+        raise
+
+      if not self.compacting and self.logger.needs_compaction():
+        self.compacting = True
+        threading.Thread(target=self.compact, daemon=True).start()
+
+  def invalidate(self):
+    with self.lock:
+      self.logger = None
+
+  # Runs fn(logger) and saves its changes, reloading and retrying if another
+  # process wrote to the data file in the meantime. Returns fn's result.
+  def mutate(self, fn, retries=3):
+    for attempt in range(retries):
+      try:
+        with self.acquire() as logger:
+          result = fn(logger)
+          logger.save()
+          return result
+      except jlogger.ConflictError:
+        if attempt == retries - 1:
+          raise
+
+  # Only rendering and replacing the data file hold the lock. Requests are
+  # served while the new data file is being written.
+  def compact(self):
+    try:
+      with self.lock:
+        logger = self.logger
+        if logger is None:
+          return
+        text, offset = logger.prepare_compaction()
+
+      tmp = logger.write_data_file(text)
+
+      with self.lock:
+        logger.commit_compaction(tmp, offset)
+    except jlogger.ConflictError:
+      # Another process wrote meanwhile. A later save will compact again.
+      pass
+    finally:
+      self.compacting = False
+
+# Parsed in this process: forking a worker pool from a multi-threaded server
+# is unsafe.
+shared_logger = SharedLogger(lambda: jlogger.Logger(workers=1))
@@ -0,0 +1,36 @@
+import collections
+import mmap
+import os
+from logger import parser
+
+# Entry content left on disk behind a memory map. Bodies are decoded on first
+# access and the most recently used ones are kept in a bounded LRU, so only
+# the pages of entries that are actually read become resident.
+# The map stays valid after the data file is replaced, since it keeps the old
+# file alive.
+class ContentStore:
+  def __init__(self, f, capacity=1024):
+    # Empty files cannot be mapped, but they have no content either.
+    self.data = b''
+    if os.fstat(f.fileno()).st_size > 0:
+      self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    self.capacity = capacity
+    self.cache = collections.OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  # Returns the lines of content in a byte range packed by parser.pack_span.
+  def get(self, span):
+    content = self.cache.get(span)
+    if content is not None:
+      self.hits += 1
+      self.cache.move_to_end(span)
+      return content
+
+    self.misses += 1
+    start, end = parser.unpack_span(span)
+    content = parser.decode_content(self.data[start:end])
+    self.cache[span] = content
+    if len(self.cache) > self.capacity:
+      self.cache.popitem(last=False)
+    return content
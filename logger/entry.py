@@ -1,16 +1,19 @@
 import datetime
-from logger.util import date_to_str
+import re
+from logger.util import date_to_epoch, date_to_str, epoch_to_date
+
+# Whitespace separated tokens starting with a URL are kept whole. Other
+# text is lowercased and split at whitespace and the characters :=(),.'?
+TOKEN_RE = re.compile(
+  r"(?<!\S)(http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|"
+  r"(?:%[0-9a-fA-F][0-9a-fA-F]))\S*)|([^\s:=(),.'?]+)")
+WORD_RE = re.compile(r"[^\s:=(),.'?]+")
 
 def tokenize(s):
-  tkns = re.compile("\s+").split(s)
-  good_tkns = []
-  for t in tkns:
-    # Check if it is a URL.
-    if re.match('http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\), ]|(?:%[0-9a-fA-F][0-9a-fA-F]))+', t) is not None:
-      good_tkns.append(t)
-      continue
-    good_tkns += re.compile("\s+|[:=(),.'?]").split(t.lower())
-  return [t for t in good_tkns if len(t) > 0]
+  # Text without URLs can be lowercased at once.
+  if 'http' not in s:
+    return WORD_RE.findall(s.lower())
+  return [url or word.lower() for url, word in TOKEN_RE.findall(s)]
 
 class bcolors:
   HEADER = '\033[95m'
@@ -22,22 +25,83 @@ class bcolors:
   BOLD = '\033[1m'
   UNDERLINE = '\033[4m'
 
-# A document holding text.
+# A document holding text. Timestamps are stored as epoch seconds and the
+# category as a tag id, resolved through the owning Logger. Content is either
+# a list of lines or a packed byte range in the Logger's content store that
+# is only decoded when read. Tokens are computed on first use and cached
+# until the title or content is assigned.
 class Entry:
-  def __init__(self, entry_id, created_at, modified_at, title, category, content, line_num):
+  __slots__ = ('id', '_title', 'category_id', 'line_num', 'created_ts',
+               'modified_ts', '_content', '_logger', '_tokens')
+
+  def __init__(self, entry_id, created_ts, modified_ts, title, category_id,
+               content, line_num, logger):
     self.id = entry_id
-    self.created_at = created_at
-    self.modified_at = modified_at
-    self.title = title
-    self.category = category
-    self.content = content
+    self.created_ts = created_ts
+    self.modified_ts = modified_ts
+    self._title = title
+    self.category_id = category_id
+    self._content = content
     self.line_num = line_num
+    self._logger = logger
+    self._tokens = None
+
+  @property
+  def title(self):
+    return self._title
+
+  @title.setter
+  def title(self, title):
+    self._title = title
+    self._tokens = None
+
+  @property
+  def created_at(self):
+    return epoch_to_date(self.created_ts)
+
+  @created_at.setter
+  def created_at(self, date):
+    self.created_ts = date_to_epoch(date)
+
+  @property
+  def modified_at(self):
+    return epoch_to_date(self.modified_ts)
 
+  @modified_at.setter
+  def modified_at(self, date):
+    self.modified_ts = date_to_epoch(date)
+
+  @property
+  def category(self):
+    return self._logger.tags_by_id[self.category_id]
+
+  @category.setter
+  def category(self, tag):
+    self.category_id = tag.id
+
+  @property
+  def content(self):
+    if type(self._content) is int:
+      return self._logger.content_store.get(self._content)
+    return self._content
+
+  @content.setter
+  def content(self, content):
+    self._content = content
+    self._tokens = None
+
+  # Lines are separated by whitespace, so tokenizing them joined gives the
+  # same tokens as tokenizing each one.
   def get_tokens(self):
-    tokens = tokenize(self.title)
-    for l in self.content:
-      tokens += tokenize(l)
-    return tokens
+    if self._tokens is None:
+      self._tokens = tokenize('\n'.join([self.title] + self.content))
+    return list(self._tokens)
+
+  # Tokens of the title and of the content.
+  def get_field_tokens(self):
+    tokens = self.get_tokens()
+    n = len(tokenize(self.title))
+    return tokens[:n], tokens[n:]
 
   def to_json(self):
     return {
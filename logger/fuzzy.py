@@ -0,0 +1,93 @@
+# Symmetric deletion lookup for spelling correction (as in SymSpell). Two
+# words within edit distance d share a string reachable from both by at
+# most d deletions, so indexing every term under its deletions lets a query
+# find its candidates by generating its own deletions instead of comparing
+# it against the whole vocabulary. Only the first PREFIX_LENGTH characters
+# are considered, which bounds the number of deletions per term; candidates
+# are verified with the actual edit distance of the full words.
+
+MAX_DISTANCE = 2
+PREFIX_LENGTH = 7
+
+# Strings obtained from the prefix of word by deleting at most max_distance
+# characters, including the prefix itself.
+def get_deletes(word, max_distance=MAX_DISTANCE):
+  word = word[:PREFIX_LENGTH]
+  deletes = {word}
+  queue = [word]
+  for _ in range(max_distance):
+    next_queue = []
+    for w in queue:
+      for i in range(len(w)):
+        d = w[:i] + w[i + 1:]
+        if d not in deletes:
+          deletes.add(d)
+          next_queue.append(d)
+    queue = next_queue
+  return deletes
+
+# Bit masks of the positions of each character in word.
+def get_peq(word):
+  peq = {}
+  for i, c in enumerate(word):
+    peq[c] = peq.get(c, 0) | (1 << i)
+  return peq
+
+# Levenshtein distance between pattern (given with its get_peq masks) and
+# text, or max_distance + 1 once it is known to exceed max_distance. This is
+# Myers' bit-parallel algorithm: bit i of the vertical delta vectors pv and
+# mv is set when D[i + 1][j] - D[i][j] is +1 or -1, so a whole column of
+# the dynamic programming matrix is updated with a few word operations.
+# Python ints make this work for patterns of any length, though it is
+# fastest up to the machine word size.
+def bounded_distance(pattern, peq, text, max_distance):
+  m = len(pattern)
+  n = len(text)
+  if abs(m - n) > max_distance:
+    return max_distance + 1
+  if m == 0:
+    return n
+
+  full = (1 << m) - 1
+  last = 1 << (m - 1)
+  pv = full
+  mv = 0
+  score = m
+  for j, c in enumerate(text):
+    eq = peq.get(c, 0)
+    xv = eq | mv
+    xh = (((eq & pv) + pv) ^ pv) | eq
+    ph = mv | (~(xh | pv) & full)
+    mh = pv & xh
+    if ph & last:
+      score += 1
+    elif mh & last:
+      score -= 1
+    # The rest of the text can lower the distance by at most one per char.
+    if score - (n - j - 1) > max_distance:
+      return max_distance + 1
+    ph = ((ph << 1) | 1) & full
+    mh = (mh << 1) & full
+    pv = mh | (~(xv | ph) & full)
+    mv = ph & xv
+  return min(score, max_distance + 1)
+
+def edit_distance(w1, w2, max_distance=MAX_DISTANCE):
+  return bounded_distance(w1, get_peq(w1), w2, max_distance)
+
+# Distances from word to each of words, bounded like edit_distance.
+def edit_distances(word, words, max_distance=MAX_DISTANCE):
+  peq = get_peq(word)
+  return [bounded_distance(word, peq, w, max_distance) for w in words]
+
+# Ranks candidate (term, count) pairs for word: terms within max_distance,
+# closest first, then most frequent. Returns (term, distance, count).
+def rank_candidates(word, candidates, max_distance=MAX_DISTANCE):
+  candidates = list(candidates)
+  distances = edit_distances(word, [t for t, _ in candidates], max_distance)
+  matches = []
+  for (term, count), distance in zip(candidates, distances):
+    if distance <= max_distance:
+      matches.append((term, distance, count))
+  matches.sort(key=lambda m: (m[1], -m[2], m[0]))
+  return matches
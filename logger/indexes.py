@@ -0,0 +1,146 @@
+import bisect
+from logger.ordered import SortedIndex
+
+# Secondary indexes over the entries of a Logger. Each is built from all
+# entries the first time it is queried (see Logger.get_index) and from then
+# on updated by Logger.attach_entry and detach_entry, which every mutation
+# goes through. Until built, updates are ignored. Keys are computed from the
+# entry, so entries are detached before the fields they are indexed by
+# change.
+#
+# Lookups by category are served by the tags, whose entries are already
+# kept in a dict per tag.
+
+def normalize_title(title):
+  return title.strip().lower()
+
+def title_key(entry):
+  return normalize_title(entry.title)
+
+def created_key(entry):
+  return entry.created_ts
+
+def modified_key(entry):
+  return entry.modified_ts
+
+# Entries by exact value of key(entry).
+class HashIndex:
+  def __init__(self, key):
+    self.key = key
+    self.buckets = {}
+    self.built = False
+
+  def build(self, entries):
+    self.buckets = buckets = {}
+    key = self.key
+    for e in entries:
+      k = key(e)
+      bucket = buckets.get(k)
+      if bucket is None:
+        bucket = buckets[k] = {}
+      bucket[e.id] = e
+    self.built = True
+
+  def add(self, entry):
+    if not self.built:
+      return
+    key = self.key(entry)
+    bucket = self.buckets.get(key)
+    if bucket is None:
+      bucket = self.buckets[key] = {}
+    bucket[entry.id] = entry
+
+  def remove(self, entry):
+    if not self.built:
+      return
+    key = self.key(entry)
+    bucket = self.buckets.get(key)
+    if bucket is not None and bucket.pop(entry.id, None) is not None:
+      if not bucket:
+        del self.buckets[key]
+
+  def get(self, value):
+    return list(self.buckets.get(value, {}).values())
+
+# Entries sorted by an int key(entry), then id, for range queries.
+class RangeIndex:
+  def __init__(self, key):
+    self.key = key
+    self.index = SortedIndex()
+    self.built = False
+
+  def pack(self, entry):
+    return (self.key(entry) << 32) | entry.id
+
+  def build(self, entries):
+    key = self.key
+    self.index.clear()
+    self.index.update([((key(e) << 32) | e.id, e) for e in entries])
+    self.built = True
+
+  def add(self, entry):
+    if self.built:
+      self.index.insert(self.pack(entry), entry)
+
+  def remove(self, entry):
+    if self.built:
+      self.index.remove(self.pack(entry))
+
+  # Entries with since <= key < until, either bound being optional, in key
+  # order or from the last with reverse.
+  def range(self, since=None, until=None, reverse=False):
+    low = None if since is None else (since << 32) - 1
+    high = None if until is None else until << 32
+    if reverse:
+      for key, entry in self.index.iter_items(True, high):
+        if low is not None and key <= low:
+          return
+        yield entry
+    else:
+      for key, entry in self.index.iter_items(start=low):
+        if high is not None and key >= high:
+          return
+        yield entry
+
+# Sorted array of tag names for prefix queries. Like the entry indexes, it
+# is built on first use and ignores updates until then.
+class PrefixIndex:
+  def __init__(self):
+    self.names = []
+    self.built = False
+
+  def build(self, names):
+    self.names = sorted(names)
+    self.built = True
+
+  def add(self, name):
+    if self.built:
+      bisect.insort(self.names, name)
+
+  def remove(self, name):
+    if not self.built:
+      return
+    i = bisect.bisect_left(self.names, name)
+    if i < len(self.names) and self.names[i] == name:
+      del self.names[i]
+
+  # Names starting with prefix in sorted order, at most limit if given.
+  def complete(self, prefix, limit=None):
+    start = bisect.bisect_left(self.names, prefix)
+    end = len(self.names) if limit is None else start + limit
+    names = []
+    for name in self.names[start:end]:
+      if not name.startswith(prefix):
+        break
+      names.append(name)
+    return names
+
+# Indexes every Logger maintains, by name.
+ENTRY_INDEXES = {
+  'title': (HashIndex, title_key),
+  'created': (RangeIndex, created_key),
+  'modified': (RangeIndex, modified_key),
+}
+
+def create_indexes():
+  return {name: cls(key) for name, (cls, key) in ENTRY_INDEXES.items()}
@@ -3,6 +3,7 @@ import datetime
 import functools
 import glob
 import io
+import itertools
 import json
 import math
 import os
@@ -18,64 +19,256 @@ import tty
 import yaml
 import os.path
 from collections import Counter
+from logger.content import ContentStore
 from logger.entry import Entry
+from logger.ordered import SortedIndex
 from logger.tag import Tag
-from logger.util import str_to_date, strip_lines
+from logger.parser import ENTRY_PATTERN
+from logger.util import date_to_epoch, file_lock, file_signature, gc_paused
+from logger import indexes
+from logger import journal
+from logger import parser
+from logger import shards
+from logger import snapshot
 
 ROOT_PATH = os.path.dirname(os.path.realpath(__file__))
 DATA_PATH = os.path.realpath(os.path.join(ROOT_PATH, '../files'))
 FILENAME = 'jmfveneroso.txt'
-ENTRY_PATTERN = ("^([A-Z])(\d{8}) \[(\d{4}-\d{2}-\d{2} "
-                 "\d{2}:\d{2}:\d{2})\|(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\]")
+JOURNAL_THRESHOLD = 1 << 20 # Journal size in bytes that triggers compaction.
+PARALLEL_THRESHOLD = 64 << 20 # Data file size in bytes parsed in parallel.
+LOAD_RETRIES = 3 # Loads repeated when a compaction races them.
+
+def get_data_file():
+  return os.path.join(DATA_PATH, FILENAME)
+
+def get_lock_file():
+  return os.path.join(DATA_PATH, '.%s.lock' % FILENAME)
+
+# Directory of the sharded layout. When it has a manifest it replaces the
+# data file, while the journal and the lock file stay the same. It is hidden
+# like the lock file so the file syncer skips it.
+def get_shards_dir():
+  return os.path.join(DATA_PATH, '.%s.shards' % os.path.splitext(FILENAME)[0])
+
+# Versions of the data file (or shards) and its journal. Any write changes it.
+def get_signature():
+  path = get_data_file()
+  directory = get_shards_dir()
+  if shards.is_sharded(directory):
+    data_signature = shards.signature(directory)
+  else:
+    data_signature = file_signature(path)
+  return (data_signature, file_signature(journal.get_journal_file(path)))
+
+# True if both signatures refer to the same file, allowing it to have grown.
+def same_file(signature, other):
+  if signature is None or other is None:
+    return signature is other
+  return signature[0] == other[0] and signature[1] >= other[1]
+
+# Raised when the data changed on disk since it was loaded by this Logger.
+class ConflictError(Exception):
+  pass
+
+# Every change to the entries or tags of a Logger gives it a new version.
+# Versions are unique within the process, so results cached for one state of
+# one Logger are never taken for another (see querycache.py).
+VERSIONS = itertools.count(1)
 
 # Logger class to map entries into a data file.
 class Logger:
-  def __init__(self):
-    self.load()
+  def __init__(self, use_snapshot=False, lazy=False, tags=None, latest=None,
+               workers=None):
+    self.auto_compact = True
+    self.load(use_snapshot, lazy, tags, latest, workers)
 
   def clear(self):
     self.entries_by_id = {}
     self.main_tag = None
     self.tags_by_name = {}
     self.tags_by_id = {}
-
-  def load(self):
+    self.signature = None
+    self.pending = []
+    self.content_store = None
+    self.shards = None
+    self.partial = False
+    self.indexes = indexes.create_indexes()
+    self.tag_names = indexes.PrefixIndex()
+    self.tag_order = None
+    self.version = next(VERSIONS)
+
+  # With use_snapshot, parsed records are read from (and written to) a binary
+  # snapshot next to the data file, so unchanged files are not parsed again.
+  # With lazy, entry content stays in a memory map of the data file and is
+  # only decoded when read. Journal records are replayed on top in all cases.
+  #
+  # If the corpus is sharded, snapshots and lazy loading are not used, and
+  # tags (a list of tag names) or latest (a number of entries) restrict the
+  # load to the shards holding their entries. See parse_shards.
+  #
+  # Data files of at least PARALLEL_THRESHOLD bytes are parsed by a pool of
+  # workers processes (os.cpu_count() if None). Pass workers=1 to disable it.
+  def load(self, use_snapshot=False, lazy=False, tags=None, latest=None,
+           workers=None):
+    # A compaction between opening the journal and reading the data file
+    # leaves records that are already folded into it, or superseded by later
+    # ones that were. Those that no longer apply are skipped, and the load is
+    # repeated so no entry removed along with its tag is brought back.
+    for attempt in range(LOAD_RETRIES):
+      self.load_once(use_snapshot, lazy, tags, latest, workers)
+      if get_signature()[0] == self.signature[0]:
+        return
+
+  def load_once(self, use_snapshot, lazy, tags, latest, workers):
     self.clear()
-    with open(os.path.join(DATA_PATH, FILENAME)) as f:
-      i, lines = 0, f.readlines()
-      i = self.load_tags(lines, i)
-      i = self.load_entries(lines, i)
+    path = get_data_file()
+    # Taken before reading so a concurrent write is detected as staleness.
+    self.signature = get_signature()
+
+    # Compaction replaces the data file before discarding the journal, so
+    # opening the journal first never misses records.
+    journal_file = journal.open_journal(path)
+    with gc_paused():
+      if shards.is_sharded(get_shards_dir()):
+        self.parse_shards(tags, latest)
+      elif lazy:
+        self.parse_lazy(path, use_snapshot)
+      else:
+        self.parse(path, use_snapshot, workers or os.cpu_count() or 1)
+      # Entries are attached without updating the tag aggregates, which are
+      # computed here at once. Indexes are built when first queried.
+      self.main_tag.aggregate()
+
+      if journal_file is not None:
+        with journal_file:
+          for record in journal.read(journal_file):
+            self.apply_record(record)
+
+  def parse(self, path, use_snapshot, workers=1):
+    records = snapshot.load(path) if use_snapshot else None
+    if records is not None:
+      self.load_tags(records[0])
+      self.load_entries(records[1])
+      return
+
+    if workers > 1 and os.path.getsize(path) >= PARALLEL_THRESHOLD:
+      records = parser.parse_parallel(path, workers)
 
-  def load_tags(self, lines, i):
-    self.main_tag = Tag(0, 'main', [])
+    if records is not None:
+      tags, entries = records
+      self.load_tags(tags)
+      self.load_entries(entries)
+    else:
+      with open(path) as f:
+        lines = parser.numbered_lines(f)
+        tags = parser.iter_tags(lines)
+        entries = parser.iter_entries(lines)
+        if use_snapshot:
+          tags, entries = list(tags), list(entries)
+        self.load_tags(tags)
+        self.load_entries(entries)
+
+    if use_snapshot:
+      snapshot.save(path, self.signature[0], tags, entries)
+
+  # Records the byte range of each entry's content instead of reading it.
+  def parse_lazy(self, path, use_snapshot):
+    with open(path, 'rb') as f:
+      st = os.fstat(f.fileno())
+      self.content_store = ContentStore(f)
+
+      records = snapshot.load(path, lazy=True, st=st) if use_snapshot else None
+      if records is not None:
+        self.load_tags(records[0])
+        self.load_entries(records[1])
+        return
+
+      data = self.content_store.data
+      tags, offset, line_num = parser.read_binary_tags(data)
+      entries = parser.iter_entry_spans(data, offset, line_num)
+      if use_snapshot:
+        entries = list(entries)
+      self.load_tags(tags)
+      self.load_entries(entries)
+
+    if use_snapshot and self.signature[0] == (st.st_ino, st.st_size,
+                                              st.st_mtime_ns):
+      snapshot.save(path, self.signature[0], tags, entries, lazy=True)
+
+  # Segment files are opened before reading any of them, so a compaction
+  # removing them meanwhile is noticed while the manifest can still be read
+  # again. Open files remain readable after being removed.
+  def open_segments(self, directory, retries=3):
+    for attempt in range(retries):
+      manifest = shards.read_manifest(directory)
+      files = {}
+      try:
+        for s in manifest['shards']:
+          files[s['file']] = open(os.path.join(directory, s['file']))
+        return manifest, files
+      except FileNotFoundError:
+        for f in files.values():
+          f.close()
+        if attempt == retries - 1:
+          raise
+
+  # Loads the tag hierarchy from the manifest and the entries of the shards
+  # needed for the given tags (and their descendants) or for the latest n
+  # modified entries. Shards whose modification range overlaps the latest
+  # entries loaded in a first pass are read in a second one. A partial
+  # Logger can save to the journal, but not compact or convert.
+  def parse_shards(self, tag_names=None, latest=None):
+    directory = get_shards_dir()
+    manifest, files = self.open_segments(directory)
+    try:
+      self.shards = manifest
+      self.load_tags(manifest['tags'])
+      self.partial = tag_names is not None or latest is not None
+
+      if tag_names is not None:
+        tag_ids = set()
+        for name in tag_names:
+          tag = self.resolve_tag(name)
+          tag_ids.update(t.id for t in tag.get_child_tags())
+        selected = shards.select_tags(manifest, tag_ids)
+      elif latest is not None:
+        selected = shards.select_latest(manifest, latest)
+      else:
+        selected = manifest['shards']
+
+      for s in selected:
+        self.load_entries(parser.iter_entries(
+          parser.numbered_lines(files[s['file']])))
+
+      if latest is not None and len(self.entries_by_id) >= latest > 0:
+        threshold = sorted(e.modified_ts for e in
+                           self.entries_by_id.values())[-latest]
+        loaded = {s['file'] for s in selected}
+        for s in shards.select_latest(manifest, latest, threshold):
+          if s['file'] not in loaded:
+            self.load_entries(parser.iter_entries(
+              parser.numbered_lines(files[s['file']])))
+    finally:
+      for f in files.values():
+        f.close()
+
+  def load_tags(self, records):
+    self.main_tag = Tag(0, 'main')
     self.tags_by_name['main'] = self.main_tag 
     self.tags_by_id[0] = self.main_tag 
 
-    other_tag = Tag(1, 'other', [])
+    other_tag = Tag(1, 'other')
     self.tags_by_name['other'] = other_tag
     self.tags_by_id[1] = other_tag 
     self.main_tag.add_child(other_tag)
+    other_tag.parent = self.main_tag
 
     cur_indents = -1
     stack = [self.main_tag]
-    while i < len(lines):
-      line = lines[i].rstrip()
-      if len(line) == 0:
-        break
-
-      num_spaces = 0
-      for j in range(len(line)):
-        if line[j] != ' ':
-          break
-        num_spaces += 1
-      num_indents = num_spaces / 2
-
-      tag_name, tag_id = line[num_spaces:].strip().split(' ')
-      tag_id = int(tag_id)
-
+    for num_indents, tag_name, tag_id in records:
       if tag_name not in self.tags_by_name:
         # raise Exception('Duplicate tag %s' % tag_name)
-        tag = Tag(tag_id, tag_name, [])
+        tag = Tag(tag_id, tag_name)
         self.tags_by_name[tag_name] = tag
         self.tags_by_id[tag_id] = tag
 
@@ -88,50 +281,124 @@ class Logger:
       tag.parent = parent
       cur_indents = num_indents
       stack.append(tag)
-      i += 1
-    return i + 1
-
-  def load_entries(self, lines, i): 
-    while i < len(lines):
-      match = re.search(ENTRY_PATTERN, lines[i])
-      if match is None:
-        i += 1
-        continue
-
-      entry_id = int(match.group(2))
-      created_at = str_to_date(match.group(3))
-      modified_at = str_to_date(match.group(4))
-      header = lines[i][match.span()[1]:].strip()
 
-      title = ''
-      entry_tags = []
-      match = re.search("^\([^)]+\)", header)
-      if match is None:
-        title = header
-      else:
-        entry_tags = [t.strip() for t in match.group()[1:-1].lower().split('|')]
-        title = header[match.span()[1]:]
-
-      i += 1
-      line_num = i
-      content = []
-      while i < len(lines):
-        match = re.search(ENTRY_PATTERN, lines[i])
-        if match is not None:
-          break
-        content.append(lines[i].rstrip())
-        i += 1
-      content = strip_lines(content)
-
-      category = self.tags_by_name['other']
+  def load_entries(self, records):
+    other_tag = self.tags_by_name['other']
+    for (entry_id, created_ts, modified_ts, title, entry_tags, content,
+         line_num) in records:
+      category = other_tag
       if len(entry_tags) and entry_tags[0] in self.tags_by_name:
         category = self.tags_by_name[entry_tags[0]]
 
-      entry = Entry(entry_id, created_at, modified_at, title, 
-                    category, content, line_num)
-      self.entries_by_id[int(entry.id)] = entry
-      category.add_entry(entry)
-    return i
+      entry = Entry(entry_id, created_ts, modified_ts, title, 
+                    category.id, content, line_num, self)
+      self.entries_by_id[entry_id] = entry
+      category.attach_entry(entry)
+
+  # Records referring to tags that no longer exist, or naming a tag like
+  # another one, were replayed over a newer data file and are skipped.
+  def apply_record(self, record):
+    op = record['op']
+    if op == 'entry':
+      if record['tag'] in self.tags_by_id:
+        self.put_entry(*journal.decode_entry_record(record))
+    elif op == 'delete_entry':
+      entry = self.entries_by_id.pop(record['id'], None)
+      if entry is not None:
+        self.detach_entry(entry)
+    elif op == 'tag':
+      holder = self.tags_by_name.get(record['name'])
+      if (record['parent'] in self.tags_by_id and
+          (holder is None or holder.id == record['id'])):
+        self.put_tag(record['id'], record['name'], record['parent'])
+    elif op == 'delete_tag':
+      if record['id'] in self.tags_by_id:
+        self.remove_tag(record['id'])
+
+  def put_entry(self, entry_id, created_ts, modified_ts, title, tag_id,
+                content):
+    tag = self.get_tag_by_id(tag_id)
+    entry = self.entries_by_id.get(entry_id)
+    if entry is None:
+      entry = Entry(entry_id, created_ts, modified_ts, title, tag.id, content,
+                    -1, self)
+      self.entries_by_id[entry_id] = entry
+    else:
+      self.detach_entry(entry)
+      entry.created_ts = created_ts
+      entry.modified_ts = modified_ts
+      entry.title = title
+      entry.content = content
+    self.attach_entry(entry, tag)
+
+  # Adds an entry to tag and to the indexes. Entries are detached while
+  # their fields change.
+  def attach_entry(self, entry, tag):
+    tag.add_entry(entry)
+    for index in self.indexes.values():
+      index.add(entry)
+    self.version = next(VERSIONS)
+
+  def detach_entry(self, entry):
+    entry.category.remove_entry(entry)
+    self.unindex_entry(entry)
+
+  def unindex_entry(self, entry):
+    for index in self.indexes.values():
+      index.remove(entry)
+    self.version = next(VERSIONS)
+
+  def get_index(self, name):
+    index = self.indexes[name]
+    if not index.built:
+      index.build(self.entries_by_id.values())
+    return index
+
+  def put_tag(self, tag_id, name, parent_id):
+    parent = self.get_tag_by_id(parent_id)
+    holder = self.tags_by_name.get(name)
+    if holder is not None and holder.id != tag_id:
+      raise Exception('Tag with name %s already exists' % name)
+
+    self.version = next(VERSIONS)
+    tag = self.tags_by_id.get(tag_id)
+    if tag is None:
+      tag = Tag(tag_id, name)
+      if self.tag_order is not None:
+        tag.order = self.tag_order
+        self.tag_order.insert(tag.order_key(), tag)
+      tag.parent = parent
+      self.tags_by_id[tag_id] = tag
+      parent.add_child(tag)
+    elif tag.parent is not parent:
+      tag.parent.delete_child(tag_id)
+      tag.parent = parent
+      parent.add_child(tag)
+
+    if self.tags_by_name.get(tag.name) is tag:
+      del self.tags_by_name[tag.name]
+      self.tag_names.remove(tag.name)
+    tag.name = name
+    if name not in self.tags_by_name:
+      self.tag_names.add(name)
+    self.tags_by_name[name] = tag
+    return tag
+
+  def remove_tag(self, id):
+    tag = self.get_tag_by_id(id)
+    tag.parent.delete_child(id)
+    self.version = next(VERSIONS)
+    for c in tag.get_child_tags():
+      for e in c.entries.values():
+        del self.entries_by_id[e.id]
+        self.unindex_entry(e)
+      del self.tags_by_id[c.id]
+      del self.tags_by_name[c.name]
+      self.tag_names.remove(c.name)
+      if c.order is not None:
+        c.order.remove(c.order_key())
+        c.order = None
+    return tag
 
   def write_tag_hierarchy(self, f, tag=None, indents=0):
     if tag is None:
@@ -145,6 +412,21 @@ class Logger:
     for c in tag.children:
       self.write_tag_hierarchy(f, c, indents)
 
+  # Renders the data file in its canonical format and updates the line
+  # numbers of the entries to point into it.
+  def render(self):
+    f = io.StringIO()
+    self.write_tag_hierarchy(f)
+    f.write('\n')
+
+    line_num = f.getvalue().count('\n') + 1
+    for e in self.get_entries():
+      s = str(e)
+      e.line_num = line_num
+      line_num += s.count('\n')
+      f.write(s)
+    return f.getvalue()
+
   def get_next_entry_id(self):
     return max(self.entries_by_id.keys()) + 1
 
@@ -156,13 +438,138 @@ class Logger:
   # Public.
   # ==========================
 
+  # Appends the changes made since the last save to the journal. The cost is
+  # proportional to the size of the changes, not of the corpus.
   def save(self):
-    with open(os.path.join(DATA_PATH, FILENAME), 'w') as f:
-      self.write_tag_hierarchy(f)
-      f.write('\n')
-    
-      for e in self.get_entries():
-        f.write(str(e))
+    self.save_pending()
+    if self.auto_compact and self.needs_compaction():
+      self.compact()
+
+  # Writers hold an exclusive lock and only write if the data on disk is the
+  # version this instance loaded, so concurrent processes never lose each
+  # other's changes. Readers do not lock.
+  def save_pending(self):
+    if not self.pending:
+      return
+
+    with file_lock(get_lock_file()):
+      if get_signature() != self.signature:
+        raise ConflictError('Data file changed since it was loaded')
+      journal.append(get_data_file(), self.pending)
+      self.pending = []
+      self.signature = get_signature()
+
+  def needs_compaction(self):
+    return (not self.partial and
+            journal.size(get_data_file()) > JOURNAL_THRESHOLD)
+
+  # Rewrites the corpus in the sharded layout, with one shard per top-level
+  # tag (by='tag') or per month (by='month'), or as a single data file if by
+  # is None. The journal is folded in and removed.
+  def convert(self, by=None):
+    if self.partial:
+      raise Exception('Cannot convert a partially loaded corpus')
+
+    self.save_pending()
+    path = get_data_file()
+    directory = get_shards_dir()
+    with file_lock(get_lock_file()):
+      if get_signature() != self.signature:
+        raise ConflictError('Data file changed since it was loaded')
+
+      # The new layout is complete before the old one is removed, and
+      # readers prefer the shards while both exist.
+      if by is None:
+        self.shards = None
+        os.replace(self.write_data_file(self.render()), path)
+        shards.remove(directory)
+      else:
+        manifest = shards.write(directory, by, *shards.render(self, by))
+        shards.commit(directory, manifest)
+        self.shards = manifest
+        if os.path.exists(path):
+          os.remove(path)
+
+      if self.signature[1] is not None:
+        journal.discard(path, self.signature[1][1])
+      self.signature = get_signature()
+
+  # File holding the entry as of the last compaction, to be edited in place.
+  def get_entry_file(self, entry):
+    if self.shards is None:
+      return get_data_file()
+
+    key = shards.shard_key(entry, self.shards['by'])
+    for s in self.shards['shards']:
+      if s['key'] == key:
+        return os.path.join(get_shards_dir(), s['file'])
+    raise Exception('Entry %d is not in any shard' % entry.id)
+
+  # Folds the journal into the data file.
+  def compact(self):
+    text, offset = self.prepare_compaction()
+    self.commit_compaction(self.write_data_file(text), offset)
+
+  # Compaction is split in steps so the slow write of the new data file can
+  # run without blocking other users of this instance. Returns the new
+  # content of the data file (or shards) and the journal offset it covers.
+  def prepare_compaction(self):
+    if self.partial:
+      raise Exception('Cannot compact a partially loaded corpus')
+
+    self.save_pending()
+    journal_signature = self.signature[1]
+    offset = 0 if journal_signature is None else journal_signature[1]
+    if self.shards is not None:
+      return shards.render(self, self.shards['by']), offset
+    return self.render(), offset
+
+  # Writes a temporary file next to the data file and returns its path. For
+  # the sharded layout, writes new segments and returns their manifest.
+  def write_data_file(self, text):
+    if self.shards is not None:
+      return shards.write(get_shards_dir(), self.shards['by'], *text)
+
+    path = get_data_file()
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'w') as f:
+      f.write(text)
+      f.flush()
+      os.fsync(f.fileno())
+    return tmp
+
+  # Atomically replaces the data file with tmp and drops the journal prefix
+  # it covers. Records appended by other processes after the offset survive.
+  def commit_compaction(self, tmp, offset):
+    path = get_data_file()
+    with file_lock(get_lock_file()):
+      data_signature, journal_signature = get_signature()
+      if (data_signature != self.signature[0] or
+          not same_file(journal_signature, self.signature[1])):
+        if self.shards is not None:
+          shards.remove_segments(get_shards_dir(), tmp)
+        else:
+          os.remove(tmp)
+        raise ConflictError('Data file changed since it was loaded')
+
+      if self.shards is not None:
+        shards.commit(get_shards_dir(), tmp)
+        self.shards = tmp
+      else:
+        os.replace(tmp, path)
+      if offset > 0:
+        journal.discard(path, offset)
+
+      self.signature = get_signature()
+      folded = journal_signature is None or journal_signature[1] == offset
+      if not folded:
+        # Records we have not seen yet are still in the journal.
+        self.signature = (self.signature[0], None)
+
+  # True if the data file or the journal changed on disk since they were last
+  # loaded or saved.
+  def is_stale(self):
+    return get_signature() != self.signature
 
 
   # ------- Entries --------
@@ -172,42 +579,76 @@ class Logger:
       return self.entries_by_id[id]
     raise Exception('Entry with id %d does not exist' % id)
 
+  # Entries from oldest to newest modified.
   def get_entries(self):
-    entries = list(self.entries_by_id.values())
-    entries.sort(key=lambda e: e.modified_at)
-    return entries
+    return self.get_index('modified').index.get_values()
+
+  # Returns the n most recently modified entries older than cursor, newest
+  # first, and the cursor for the next page (None after the last one).
+  def get_latest_entries(self, n, cursor=None):
+    page = list(itertools.islice(self.get_index('modified').index.iter_items(
+      reverse=True, start=cursor), n))
+    next_cursor = page[-1][0] if len(page) == n and n > 0 else None
+    return [e for _, e in page], next_cursor
+
+  # Entries created (or modified, with field='modified') in the range of
+  # datetimes since <= date < until, oldest first. Either bound is optional.
+  def get_entries_between(self, since=None, until=None, field='created'):
+    since = None if since is None else date_to_epoch(since)
+    until = None if until is None else date_to_epoch(until)
+    return list(self.get_index(field).range(since, until))
+
+  # Entries whose title matches, ignoring case and surrounding spaces.
+  def get_entries_by_title(self, title):
+    return self.get_index('title').get(indexes.normalize_title(title))
+
+  # Entries in a tag, and in its descendants with subtree.
+  def get_entries_by_category(self, tag_id, subtree=False):
+    tag = self.get_tag_by_id(tag_id)
+    if subtree:
+      return tag.get_entries()
+    return list(tag.entries.values())
 
   def create_entry(self, name, tag_id):
     tag = self.get_tag_by_id(tag_id)
     id = self.get_next_entry_id()
-    date = datetime.datetime.now()
-    new_entry = Entry(id, date, date, name, tag, [], -1)
-    tag.add_entry(new_entry)
+    date = date_to_epoch(datetime.datetime.now())
+    new_entry = Entry(id, date, date, name, tag.id, [], -1, self)
+    self.attach_entry(new_entry, tag)
     self.entries_by_id[id] = new_entry
+    self.pending.append(journal.entry_record(new_entry))
     return new_entry
 
   def delete_entry(self, id):
     entry = self.entries_by_id[id]
     if int(id) in self.entries_by_id:
       del self.entries_by_id[id]
+    self.detach_entry(entry)
+    self.pending.append(journal.delete_entry_record(entry.id))
     return entry
 
   def edit_entry(self, attributes):
     entry = self.get_entry_by_id(int(attributes['id']))
+    tag = entry.category
+    # Resolved before detaching so an unknown tag leaves the entry intact.
+    if 'tag' in attributes:
+      tag = self.get_tag_by_name(attributes['tag'])
+    self.detach_entry(entry)
     for attr in attributes:
       if attr == 'tag':
-        tag = self.get_tag_by_name(attributes['tag'])
-        tag.add_entry(entry)
-        
+        continue
+
       elif hasattr(entry, attr):
-        if not callable(getattr(entry, attr)) and not attr.startswith("__"):
+        if not callable(getattr(entry, attr)) and not attr.startswith("_"):
           if attr == 'id':
             entry.id = int(attributes[attr])
           elif attr == 'content':
             entry.content = attributes[attr].split('\n')
           else:
             setattr(entry, attr, attributes[attr])
-    entry.modified_at = datetime.datetime.now()
+    entry.modified_ts = date_to_epoch(datetime.datetime.now())
+    self.attach_entry(entry, tag)
+    self.pending.append(journal.entry_record(entry))
     return entry
 
 
@@ -223,38 +664,62 @@ class Logger:
       return self.tags_by_name[name]
     raise Exception('Tag with name %s does not exist' % name)
 
+  # Names of the tags starting with prefix, sorted, at most limit if given.
+  def complete_tag_name(self, prefix, limit=None):
+    if not self.tag_names.built:
+      self.tag_names.build(self.tags_by_name)
+    return self.tag_names.complete(prefix, limit)
+
+  # Returns the tag with the given name, or the only one it abbreviates.
+  def resolve_tag(self, name):
+    tag = self.find_tag(name)
+    if tag is not None:
+      return tag
+
+    names = self.complete_tag_name(name, 10)
+    if names:
+      raise Exception('Tag %s is ambiguous: %s' % (name, ', '.join(names)))
+    raise Exception('Tag with name %s does not exist' % name)
+
+  # Like resolve_tag, but returns None for unknown or ambiguous names.
+  def find_tag(self, name):
+    if name in self.tags_by_name:
+      return self.tags_by_name[name]
+
+    names = self.complete_tag_name(name, 2)
+    if len(names) == 1:
+      return self.tags_by_name[names[0]]
+    return None
+
+  # Tags from newest to oldest modified, then by descending id. They are
+  # kept in a SortedIndex from the first call on, which tags update as
+  # their modification times change (see Tag).
   def get_tags(self):
-    tags = list(self.tags_by_id.values())
-    tags.sort(key=lambda t: t.modified_at, reverse=True)
-    return tags
+    if self.tag_order is None:
+      self.tag_order = SortedIndex(
+        (t.order_key(), t) for t in self.tags_by_id.values())
+      for t in self.tags_by_id.values():
+        t.order = self.tag_order
+    return self.tag_order.get_values()[::-1]
 
   def create_tag(self, parent_id):
-    parent = self.get_tag_by_id(parent_id)
     tag_id = self.get_next_tag_id()
-    name = 'new-%d' % tag_id
-    tag = Tag(tag_id, name, [])
-    tag.parent = parent
-    self.tags_by_name[name] = tag
-    self.tags_by_id[tag_id] = tag
-    parent.children.append(tag)
+    tag = self.put_tag(tag_id, 'new-%d' % tag_id, parent_id)
+    self.pending.append(journal.tag_record(tag))
     return tag 
 
   def delete_tag(self, id):
-    tag = self.get_tag_by_id(id)
-    tag.parent.delete_child(id)
-    for c in tag.get_child_tags():
-      for e in c.entries:
-        del self.entries_by_id[e.id]
-      del self.tags_by_id[c.id]
-      del self.tags_by_name[c.name]
+    tag = self.remove_tag(id)
+    self.pending.append(journal.delete_tag_record(tag.id))
     return tag
 
   def edit_tag(self, attributes):
     tag = self.get_tag_by_id(int(attributes['id']))
-    tag.name = attributes['name'] if 'name' in attributes else tag.name
- 
-    if 'parent' in attributes and attributes['parent'] and attributes['parent'] != tag.parent.id:
-      tag.parent.delete_child(int(attributes['id']))
-      new_parent = self.get_tag_by_id(attributes['parent'])
-      new_parent.add_child(tag)
+    name = attributes['name'] if 'name' in attributes else tag.name
+    parent_id = tag.parent.id
+    if 'parent' in attributes and attributes['parent']:
+      parent_id = attributes['parent']
+
+    self.put_tag(tag.id, name, parent_id)
+    self.pending.append(journal.tag_record(tag))
     return tag
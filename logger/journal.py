@@ -0,0 +1,81 @@
+import json
+import os
+import tempfile
+from logger.parser import decode_timestamp
+from logger.util import date_to_str, file_signature
+
+# Append-only journal of mutations applied on top of the data file. Each line
+# is a JSON record holding the full new state of an entry or tag (or a
+# deletion), so replaying a record more than once is harmless. This lets
+# compaction rewrite the data file before discarding the journal without
+# any risk of losing or duplicating changes.
+
+def get_journal_file(path):
+  return os.path.splitext(path)[0] + '.journal'
+
+def entry_record(entry):
+  return {
+    'op': 'entry',
+    'id': entry.id,
+    'created_at': date_to_str(entry.created_at),
+    'modified_at': date_to_str(entry.modified_at),
+    'title': entry.title,
+    'tag': entry.category.id,
+    'content': entry.content,
+  }
+
+def delete_entry_record(entry_id):
+  return {'op': 'delete_entry', 'id': entry_id}
+
+def tag_record(tag):
+  return {'op': 'tag', 'id': tag.id, 'name': tag.name, 'parent': tag.parent.id}
+
+def delete_tag_record(tag_id):
+  return {'op': 'delete_tag', 'id': tag_id}
+
+def decode_entry_record(record):
+  return (record['id'], decode_timestamp(record['created_at']),
+          decode_timestamp(record['modified_at']), record['title'],
+          record['tag'], record['content'])
+
+def size(path):
+  signature = file_signature(get_journal_file(path))
+  return 0 if signature is None else signature[1]
+
+def append(path, records):
+  data = ''.join(json.dumps(r) + '\n' for r in records)
+  with open(get_journal_file(path), 'a') as f:
+    f.write(data)
+    f.flush()
+    os.fsync(f.fileno())
+
+def open_journal(path):
+  try:
+    return open(get_journal_file(path))
+  except FileNotFoundError:
+    return None
+
+# Yields the records in an open journal. A trailing line without a newline
+# is an append still in progress and is ignored.
+def read(f):
+  for line in f:
+    if not line.endswith('\n'):
+      return
+    yield json.loads(line)
+
+# Drops the first offset bytes of the journal, which compaction has already
+# folded into the data file.
+def discard(path, offset):
+  journal_file = get_journal_file(path)
+  with open(journal_file, 'rb') as f:
+    f.seek(offset)
+    tail = f.read()
+
+  if not tail:
+    os.remove(journal_file)
+    return
+
+  fd, tmp = tempfile.mkstemp(dir=os.path.dirname(journal_file))
+  with os.fdopen(fd, 'wb') as f:
+    f.write(tail)
+  os.replace(tmp, journal_file)
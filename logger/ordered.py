@@ -0,0 +1,115 @@
+import bisect
+import itertools
+import operator
+
+# Sorted map from int keys to values, stored as a list of buckets of at most
+# 2 * load sorted keys (with their values alongside) and the last key of each
+# bucket. Finding a key bisects the bucket maxima and then the bucket, and
+# inserting or removing moves at most one bucket's worth of items, so both
+# are O(log n) in practice.
+class SortedIndex:
+  def __init__(self, items=(), load=512):
+    self.load = load
+    self.clear()
+    self.update(items)
+
+  def clear(self):
+    self.keys = []
+    self.values = []
+    self.maxes = []
+    self.size = 0
+
+  def __len__(self):
+    return self.size
+
+  # Replaces the contents with (key, value) pairs, sorting them once.
+  def update(self, items):
+    items = list(itertools.chain(self.items(), items))
+    items.sort(key=operator.itemgetter(0))
+    keys = [k for k, _ in items]
+    values = [v for _, v in items]
+    self.clear()
+    for start in range(0, len(items), self.load):
+      self.keys.append(keys[start:start + self.load])
+      self.values.append(values[start:start + self.load])
+      self.maxes.append(self.keys[-1][-1])
+    self.size = len(items)
+
+  def insert(self, key, value):
+    if not self.maxes:
+      self.keys.append([key])
+      self.values.append([value])
+      self.maxes.append(key)
+      self.size = 1
+      return
+
+    i = min(bisect.bisect_left(self.maxes, key), len(self.maxes) - 1)
+    keys = self.keys[i]
+    j = bisect.bisect_left(keys, key)
+    keys.insert(j, key)
+    self.values[i].insert(j, value)
+    self.maxes[i] = keys[-1]
+    self.size += 1
+
+    if len(keys) > 2 * self.load:
+      self.keys[i + 1:i + 1] = [keys[self.load:]]
+      self.values[i + 1:i + 1] = [self.values[i][self.load:]]
+      del keys[self.load:]
+      del self.values[i][self.load:]
+      self.maxes.insert(i, keys[-1])
+
+  # Removes key if present and returns its value, or None.
+  def remove(self, key):
+    i = bisect.bisect_left(self.maxes, key)
+    if i == len(self.maxes):
+      return None
+    keys = self.keys[i]
+    j = bisect.bisect_left(keys, key)
+    if j == len(keys) or keys[j] != key:
+      return None
+
+    del keys[j]
+    value = self.values[i].pop(j)
+    self.size -= 1
+    if keys:
+      self.maxes[i] = keys[-1]
+    else:
+      del self.keys[i], self.values[i], self.maxes[i]
+    return value
+
+  # Yields (key, value) pairs in key order, or in reverse with reverse. If
+  # start is given, only keys after it (before it in reverse) are yielded.
+  def iter_items(self, reverse=False, start=None):
+    if not reverse:
+      i = j = 0
+      if start is not None:
+        i = bisect.bisect_right(self.maxes, start)
+        if i < len(self.maxes):
+          j = bisect.bisect_right(self.keys[i], start)
+      for i in range(i, len(self.keys)):
+        keys, values = self.keys[i], self.values[i]
+        for j in range(j, len(keys)):
+          yield keys[j], values[j]
+        j = 0
+      return
+
+    i = len(self.keys) - 1
+    j = None
+    if start is not None:
+      i = bisect.bisect_left(self.maxes, start)
+      if i < len(self.maxes):
+        j = bisect.bisect_left(self.keys[i], start)
+      else:
+        i -= 1
+    for i in range(i, -1, -1):
+      keys, values = self.keys[i], self.values[i]
+      for j in range(len(keys) - 1 if j is None else j - 1, -1, -1):
+        yield keys[j], values[j]
+      j = None
+
+  def items(self):
+    return self.iter_items()
+
+  # Values in key order, without the cost of iterating pairs.
+  def get_values(self):
+    return list(itertools.chain.from_iterable(self.values))
@@ -0,0 +1,216 @@
+import datetime
+import io
+import mmap
+import multiprocessing
+import os
+import re
+import sys
+import time
+from logger.util import strip_lines
+
+# Streaming parser for the jmfveneroso.txt format. The file starts with an
+# indented tag hierarchy terminated by a blank line, followed by entries:
+#
+#   K00000001 [2020-01-01 10:00:00|2020-01-01 10:00:00] (tag) Title
+#
+#   Content...
+#
+# Lines are consumed one at a time, so the file never has to be held in memory.
+
+ENTRY_PATTERN = (r"^([A-Z])(\d{8}) \[(\d{4}-\d{2}-\d{2} "
+                 r"\d{2}:\d{2}:\d{2})\|(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\]")
+ENTRY_RE = re.compile(ENTRY_PATTERN)
+# Matches the newline before a header, which lets the regex engine skip
+# ahead to candidate positions instead of trying every one.
+ENTRY_BYTES_RE = re.compile(b'\n' + ENTRY_PATTERN[1:].encode())
+CATEGORY_RE = re.compile(r"^\([^)]+\)")
+
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+days_by_date = {}
+
+# Decodes a fixed width "YYYY-MM-DD HH:MM:SS" timestamp into epoch seconds
+# without strptime. Most entries share a date with others, so days are cached.
+def decode_timestamp(s):
+  days = days_by_date.get(s[:10])
+  if days is None:
+    days = datetime.date(int(s[0:4]), int(s[5:7]), int(s[8:10])).toordinal()
+    days = days_by_date[s[:10]] = days - EPOCH_ORDINAL
+  return (days * 86400 + int(s[11:13]) * 3600 + int(s[14:16]) * 60 +
+          int(s[17:19]))
+
+def numbered_lines(f):
+  return enumerate(f, 1)
+
+# Parses the tag hierarchy at the start of bytes or a memory map. Returns the
+# tag records and the offset and number of lines after it.
+def read_binary_tags(data):
+  lines, offset = [], 0
+  while offset < len(data):
+    end = data.find(b'\n', offset)
+    end = len(data) if end == -1 else end + 1
+    lines.append(data[offset:end].decode())
+    offset = end
+    if len(lines[-1].rstrip()) == 0:
+      break
+  return list(iter_tags(numbered_lines(lines))), offset, len(lines)
+
+# Yields (num_indents, name, id) for each line of the tag hierarchy and stops
+# after consuming the blank line that separates it from the entries.
+def iter_tags(lines):
+  for _, line in lines:
+    line = line.rstrip()
+    if len(line) == 0:
+      return
+
+    num_spaces = len(line) - len(line.lstrip(' '))
+    tag_name, tag_id = line[num_spaces:].strip().split(' ')
+    yield num_spaces / 2, tag_name, int(tag_id)
+
+def make_entry(match, line, line_num, content):
+  header = line[match.end():].strip()
+  title = header
+  entry_tags = []
+  category = CATEGORY_RE.match(header)
+  if category is not None:
+    entry_tags = [t.strip() for t in category.group()[1:-1].lower().split('|')]
+    title = header[category.end():]
+
+  return (int(match.group(2)), decode_timestamp(match.group(3)),
+          decode_timestamp(match.group(4)), title, entry_tags, content,
+          line_num)
+
+# Yields (id, created_at, modified_at, title, tags, content, line_num) for
+# each entry. Line numbers are 1-based and point at the entry header.
+def iter_entries(lines):
+  match = None
+  for line_num, line in lines:
+    # Cheap prefilter: headers always start with an uppercase letter.
+    if 'A' <= line[:1] <= 'Z':
+      next_match = ENTRY_RE.match(line)
+      if next_match is not None:
+        if match is not None:
+          yield make_entry(match, header, header_num, strip_lines(content))
+        match, header, header_num, content = next_match, line, line_num, []
+        continue
+
+    if match is not None:
+      content.append(line.rstrip())
+
+  if match is not None:
+    yield make_entry(match, header, header_num, strip_lines(content))
+
+# Packs a byte range in a single int, which takes far less memory than a
+# tuple of two.
+def pack_span(start, end):
+  return (start << 32) | (end - start)
+
+def unpack_span(span):
+  start = span >> 32
+  return start, start + (span & 0xffffffff)
+
+# Like iter_entries, but scans bytes or a memory map for headers without
+# splitting it in lines and gives the content as the packed byte range it
+# occupies instead of decoding it. Offset and line_num give the position
+# where scanning starts.
+def iter_entry_spans(data, offset=0, line_num=0):
+  header = None
+  for next_header in ENTRY_BYTES_RE.finditer(data, max(offset - 1, 0)):
+    start = next_header.start() + 1
+    line_num += data[offset:start].count(b'\n') + 1
+    if header is not None:
+      yield make_entry(header, line, header_num, pack_span(header_end, start))
+
+    header_end = data.find(b'\n', start)
+    header_end = len(data) if header_end == -1 else header_end + 1
+    line = data[start:header_end].decode()
+    header, header_num, offset = ENTRY_RE.match(line), line_num, header_end
+
+  if header is not None:
+    yield make_entry(header, line, header_num,
+                     pack_span(header_end, len(data)))
+
+# Decodes content stored in data[start:end] the same way iter_entries does.
+def decode_content(data):
+  lines = data.decode().split('\n')
+  if lines[-1] == '':
+    lines.pop()
+  return strip_lines([l.rstrip() for l in lines])
+
+# Splits data into at most n byte ranges starting at entry headers, so they
+# can be parsed independently. The first range starts at 0 and also holds the
+# tag hierarchy.
+def split_chunks(data, n):
+  bounds = [0]
+  for i in range(1, n):
+    target = max(len(data) * i // n, bounds[-1] + 1)
+    match = ENTRY_BYTES_RE.search(data, target - 1)
+    if match is None:
+      break
+    bounds.append(match.start() + 1)
+  bounds.append(len(data))
+  return list(zip(bounds, bounds[1:]))
+
+# Parses a byte range of the file at path, as returned by split_chunks, if
+# the file still has the given signature. Returns the tag records (only for
+# the first chunk), the entry records with line numbers relative to the
+# chunk and its number of lines, or None if the file changed.
+def parse_chunk(chunk):
+  path, signature, start, end = chunk
+  with open(path, 'rb') as f:
+    st = os.fstat(f.fileno())
+    if (st.st_ino, st.st_size, st.st_mtime_ns) != signature:
+      return None
+    f.seek(start)
+    data = f.read(end - start)
+
+  # Decoded like open(path) does, newline translation included.
+  text = io.TextIOWrapper(io.BytesIO(data)).read()
+  num_lines = text.count('\n') + (not text.endswith('\n') and len(text) > 0)
+  lines = numbered_lines(io.StringIO(text))
+  tags = list(iter_tags(lines)) if start == 0 else []
+  return tags, list(iter_entries(lines)), num_lines
+
+# Parses the file at path in a pool of processes, each taking chunks split
+# at entry headers. Chunks are merged in file order, so the records are the
+# same as those of a sequential parse. Returns (tags, entries), or None if
+# the file was replaced while being parsed.
+def parse_parallel(path, workers):
+  with open(path, 'rb') as f:
+    st = os.fstat(f.fileno())
+    signature = (st.st_ino, st.st_size, st.st_mtime_ns)
+    chunks = [(path, signature, 0, 0)]
+    if st.st_size > 0:
+      with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        chunks = [(path, signature, start, end)
+                  for start, end in split_chunks(data, workers * 4)]
+
+  with multiprocessing.Pool(workers) as pool:
+    results = pool.map(parse_chunk, chunks)
+  if any(r is None for r in results):
+    return None
+
+  entries = []
+  line_num = 0
+  for _, records, num_lines in results:
+    if line_num == 0:
+      entries += records
+    else:
+      entries += [r[:6] + (r[6] + line_num,) for r in records]
+    line_num += num_lines
+  return results[0][0], entries
+
+# Parses the whole file and returns the parse throughput in MB/s.
+def measure_throughput(path):
+  size = os.path.getsize(path)
+  start = time.perf_counter()
+  with open(path) as f:
+    lines = numbered_lines(f)
+    for _ in iter_tags(lines):
+      pass
+    num_entries = sum(1 for _ in iter_entries(lines))
+  elapsed = time.perf_counter() - start
+  return num_entries, size / (1024 * 1024) / elapsed
+
+if __name__ == '__main__':
+  num_entries, mbs = measure_throughput(sys.argv[1])
+  print('Parsed %d entries at %.2f MB/s' % (num_entries, mbs))
@@ -0,0 +1,133 @@
+import collections
+import json
+import os
+import pickle
+import sqlite3
+import time
+
+MEMORY_BUDGET = 16 << 20 # Bytes of pickled results kept in memory.
+DISK_BUDGET = 64 << 20 # Bytes of pickled results kept on disk.
+
+def get_cache_file(path):
+  head, tail = os.path.split(path)
+  return os.path.join(head, '.%s.cache' % tail)
+
+# LRU cache of query results for a Logger. Keys are a normalized query
+# (any hashable, JSON serializable value) qualified by the version of the
+# Logger, which every mutation changes (see Logger.version), so results of
+# an older corpus are never returned and simply age out. Sizes are those of
+# the pickled results.
+#
+# With a path, results are also kept in an SQLite file with its own budget,
+# so that separate processes (e.g. CLI invocations) share them. There they
+# are keyed by the signature of the data on disk, which only identifies the
+# corpus while the Logger has no unsaved changes, so other Loggers only use
+# the memory tier.
+class QueryCache:
+  def __init__(self, budget=MEMORY_BUDGET, path=None, disk_budget=DISK_BUDGET):
+    self.budget = budget
+    self.disk_budget = disk_budget
+    self.items = collections.OrderedDict()
+    self.size = 0
+    self.hits = 0
+    self.disk_hits = 0
+    self.misses = 0
+    self.db = None
+    if path is not None:
+      self.db = sqlite3.connect(path, isolation_level=None)
+      self.db.execute('''
+        CREATE TABLE IF NOT EXISTS results (
+          key TEXT PRIMARY KEY, value BLOB, size INTEGER, used INTEGER)
+      ''')
+
+  def close(self):
+    if self.db is not None:
+      self.db.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def get_disk_key(self, logger, key):
+    if self.db is None or logger.pending or logger.partial:
+      return None
+    return json.dumps([logger.signature, key])
+
+  # Returns the cached results for key, or None.
+  def get(self, logger, key):
+    memory_key = (logger.version, key)
+    item = self.items.get(memory_key)
+    if item is not None:
+      self.items.move_to_end(memory_key)
+      self.hits += 1
+      return pickle.loads(item)
+
+    disk_key = self.get_disk_key(logger, key)
+    if disk_key is not None:
+      row = self.db.execute('SELECT value FROM results WHERE key = ?',
+                            (disk_key,)).fetchone()
+      if row is not None:
+        self.db.execute('UPDATE results SET used = ? WHERE key = ?',
+                        (time.time_ns(), disk_key))
+        self.disk_hits += 1
+        self.put_memory(memory_key, row[0])
+        return pickle.loads(row[0])
+
+    self.misses += 1
+    return None
+
+  def put(self, logger, key, value):
+    data = pickle.dumps(value)
+    self.put_memory((logger.version, key), data)
+    disk_key = self.get_disk_key(logger, key)
+    if disk_key is not None:
+      self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                      (disk_key, data, len(data), time.time_ns()))
+      self.evict_disk()
+
+  def put_memory(self, memory_key, data):
+    if len(data) > self.budget:
+      return
+    old = self.items.pop(memory_key, None)
+    if old is not None:
+      self.size -= len(old)
+    self.items[memory_key] = data
+    self.size += len(data)
+    while self.size > self.budget:
+      _, evicted = self.items.popitem(last=False)
+      self.size -= len(evicted)
+
+  # Removes the least recently used results beyond the disk budget.
+  def evict_disk(self):
+    total = self.db.execute(
+      'SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+    if total <= self.disk_budget:
+      return
+    evicted = []
+    for key, size in self.db.execute(
+        'SELECT key, size FROM results ORDER BY used'):
+      if total <= self.disk_budget:
+        break
+      evicted.append((key,))
+      total -= size
+    self.db.executemany('DELETE FROM results WHERE key = ?', evicted)
+
+  # Returns the cached results for key, computing and caching them with
+  # compute() on a miss.
+  def get_or_compute(self, logger, key, compute):
+    value = self.get(logger, key)
+    if value is None:
+      value = compute()
+      self.put(logger, key, value)
+    return value
+
+  def stats(self):
+    return {
+      'hits': self.hits,
+      'disk_hits': self.disk_hits,
+      'misses': self.misses,
+      'entries': len(self.items),
+      'size': self.size,
+    }
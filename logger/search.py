@@ -0,0 +1,553 @@
+import bisect
+import heapq
+import json
+import math
+import os
+import re
+import sqlite3
+import zlib
+from array import array
+from collections import Counter
+from logger import fuzzy
+from logger.entry import tokenize
+
+# Writes the token counts of the vocab command: one "word count" pair per
+# line, most common first.
+def write_vocab(path, counter):
+  with open(path, 'w') as f:
+    for w in counter.most_common():
+      f.write(w[0] + ' ' + str(w[1]) + '\n')
+
+SCHEMA_VERSION = 5
+
+# Fields of an entry whose token positions are indexed separately.
+TITLE = 0
+CONTENT = 1
+
+# Weight of a title occurrence relative to a content one in the search
+# command's ranking.
+TITLE_BOOST = 2.0
+
+# BM25 parameters.
+K1 = 1.2
+B = 0.75
+
+# Scoring functions accepted by SearchIndex.search.
+SCORERS = ('bm25', 'inverse_frequency')
+
+def get_index_file(path):
+  head, tail = os.path.split(path)
+  return os.path.join(head, '.%s.search' % tail)
+
+# CRC-32 of the title and content of an entry.
+def get_checksum(entry):
+  return zlib.crc32('\n'.join([entry.title] + entry.content).encode())
+
+# Inverted index of entry tokens in an SQLite database next to the data
+# file: postings of (term, entry id, term frequency, frequency in the title),
+# the length, modification time and checksum of each indexed entry, and the
+# document frequency, collection frequency and maximum term frequency of
+# each term. Queries only read the postings of their terms. Token positions
+# are kept per term, entry and field (title or content) for phrase and
+# proximity queries, which intersect the positional postings of their
+# terms. Terms are also indexed by their deletions (see fuzzy) to correct
+# misspelled query terms. Deletions of terms that are no longer used are
+# left in place and filtered out by joining with the terms table. Likewise
+# max_tf is not lowered when entries are removed, as it is only used as an
+# upper bound.
+#
+# sync brings the index up to date with a Logger by reindexing the entries
+# whose modification time or checksum changed since they were indexed. The
+# checksum catches edits that keep the header intact (e.g. in vim), so it is
+# only computed when the data file changed. When only the journal did, the
+# modification times, which the Logger sets on every edit, are compared.
+class SearchIndex:
+  def __init__(self, path):
+    self.db = sqlite3.connect(path, isolation_level=None)
+    # Indexes built with another schema are rebuilt from scratch.
+    version = self.db.execute('PRAGMA user_version').fetchone()[0]
+    if version != SCHEMA_VERSION:
+      self.db.executescript('''
+        DROP TABLE IF EXISTS meta;
+        DROP TABLE IF EXISTS docs;
+        DROP TABLE IF EXISTS terms;
+        DROP TABLE IF EXISTS postings;
+        DROP TABLE IF EXISTS deletes;
+        DROP TABLE IF EXISTS positions;
+      ''')
+      self.db.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+    self.db.executescript('''
+      CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+      CREATE TABLE IF NOT EXISTS docs (
+        id INTEGER PRIMARY KEY, modified_ts INTEGER, length INTEGER,
+        checksum INTEGER);
+      CREATE TABLE IF NOT EXISTS terms (
+        term TEXT PRIMARY KEY, df INTEGER, cf INTEGER,
+        max_tf INTEGER) WITHOUT ROWID;
+      CREATE TABLE IF NOT EXISTS postings (
+        term TEXT, id INTEGER, tf INTEGER, title_tf INTEGER,
+        PRIMARY KEY (term, id)) WITHOUT ROWID;
+      CREATE INDEX IF NOT EXISTS postings_by_id ON postings (id);
+      CREATE TABLE IF NOT EXISTS positions (
+        term TEXT, id INTEGER, field INTEGER, positions BLOB,
+        PRIMARY KEY (term, id, field)) WITHOUT ROWID;
+      CREATE INDEX IF NOT EXISTS positions_by_id ON positions (id);
+      CREATE TABLE IF NOT EXISTS deletes (
+        key TEXT, term TEXT, PRIMARY KEY (key, term)) WITHOUT ROWID;
+    ''')
+
+  def close(self):
+    self.db.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def get_meta(self, key, default=None):
+    row = self.db.execute('SELECT value FROM meta WHERE key = ?',
+                          (key,)).fetchone()
+    return default if row is None else row[0]
+
+  def set_meta(self, key, value):
+    self.db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, value))
+
+  # Number of documents and their total length.
+  def get_totals(self):
+    return (int(self.get_meta('num_docs', 0)),
+            int(self.get_meta('total_length', 0)))
+
+  def add_to_totals(self, num_docs, length):
+    total_docs, total_length = self.get_totals()
+    self.set_meta('num_docs', total_docs + num_docs)
+    self.set_meta('total_length', total_length + length)
+
+  def add(self, entry):
+    fields = entry.get_field_tokens()
+    positions = {}
+    for field, tokens in enumerate(fields):
+      for i, t in enumerate(tokens):
+        positions.setdefault((t, field), []).append(i)
+    counts = Counter(fields[TITLE] + fields[CONTENT])
+    title_counts = Counter(fields[TITLE])
+    length = sum(counts.values())
+    self.db.execute('INSERT INTO docs VALUES (?, ?, ?, ?)',
+                    (entry.id, entry.modified_ts, length,
+                     get_checksum(entry)))
+    self.db.executemany('INSERT INTO postings VALUES (?, ?, ?, ?)', [
+      (t, entry.id, tf, title_counts[t]) for t, tf in counts.items()])
+    self.db.executemany('INSERT INTO positions VALUES (?, ?, ?, ?)', [
+      (t, entry.id, field, array('I', p).tobytes())
+      for (t, field), p in positions.items()])
+    self.db.executemany('''
+      INSERT INTO terms VALUES (?, 1, ?, ?) ON CONFLICT (term)
+      DO UPDATE SET df = df + 1, cf = cf + excluded.cf,
+                    max_tf = MAX(max_tf, excluded.max_tf)
+    ''', [(t, tf, tf) for t, tf in counts.items()])
+    self.add_deletes(counts)
+    self.add_to_totals(1, length)
+
+  # Indexes the deletions of the terms that just got their first entry.
+  def add_deletes(self, terms):
+    terms = list(terms)
+    for i in range(0, len(terms), 500):
+      chunk = terms[i:i + 500]
+      new_terms = self.db.execute(
+        'SELECT term FROM terms WHERE df = 1 AND term IN (%s)' %
+        ','.join('?' * len(chunk)), chunk).fetchall()
+      self.db.executemany('INSERT OR IGNORE INTO deletes VALUES (?, ?)', [
+        (d, t) for t, in new_terms for d in fuzzy.get_deletes(t)])
+
+  def remove(self, entry_id):
+    row = self.db.execute('SELECT length FROM docs WHERE id = ?',
+                          (entry_id,)).fetchone()
+    if row is None:
+      return
+    postings = self.db.execute('SELECT term, tf FROM postings WHERE id = ?',
+                               (entry_id,)).fetchall()
+    self.db.executemany(
+      'UPDATE terms SET df = df - 1, cf = cf - ? WHERE term = ?',
+      [(tf, t) for t, tf in postings])
+    self.db.execute('DELETE FROM terms WHERE df <= 0')
+    self.db.execute('DELETE FROM postings WHERE id = ?', (entry_id,))
+    self.db.execute('DELETE FROM positions WHERE id = ?', (entry_id,))
+    self.db.execute('DELETE FROM docs WHERE id = ?', (entry_id,))
+    self.add_to_totals(-1, -row[0])
+
+  # Reindexes the entries of a fully loaded logger that changed since the
+  # last sync. Returns the number of entries added or removed.
+  def sync(self, logger):
+    if logger.partial:
+      raise Exception('Cannot index a partially loaded corpus')
+
+    signature = json.dumps(logger.signature)
+    if self.get_meta('signature') == signature:
+      return 0
+    # Only the journal changed, so every edit went through a Logger.
+    data_signature = json.dumps(logger.signature[0])
+    journal_only = self.get_meta('data_signature') == data_signature
+
+    self.db.execute('BEGIN IMMEDIATE')
+    try:
+      indexed = {i: (modified_ts, checksum) for i, modified_ts, checksum in
+                 self.db.execute('SELECT id, modified_ts, checksum FROM docs')}
+      removed = [i for i in indexed if i not in logger.entries_by_id]
+      if journal_only:
+        changed = [e for e in logger.entries_by_id.values()
+                   if e.id not in indexed or
+                   indexed[e.id][0] != e.modified_ts]
+      else:
+        changed = [e for e in logger.entries_by_id.values()
+                   if indexed.get(e.id) != (e.modified_ts, get_checksum(e))]
+      for entry_id in removed:
+        self.remove(entry_id)
+      for e in changed:
+        self.remove(e.id)
+        self.add(e)
+      self.set_meta('signature', signature)
+      self.set_meta('data_signature', data_signature)
+      self.db.execute('COMMIT')
+    except:
+      self.db.execute('ROLLBACK')
+      raise
+    return len(removed) + len(changed)
+
+  # Collection frequency of each term.
+  def get_vocab(self):
+    return dict(self.db.execute('SELECT term, cf FROM terms'))
+
+  def has_term(self, term):
+    return self.db.execute('SELECT 1 FROM terms WHERE term = ?',
+                           (term,)).fetchone() is not None
+
+  # Terms within max_distance of word as (term, distance, count), closest
+  # first, then most frequent.
+  def get_suggestions(self, word, max_distance=fuzzy.MAX_DISTANCE):
+    keys = list(fuzzy.get_deletes(word, max_distance))
+    candidates = self.db.execute('''
+      SELECT DISTINCT t.term, t.cf FROM deletes d JOIN terms t USING (term)
+      WHERE d.key IN (%s)
+    ''' % ','.join('?' * len(keys)), keys)
+    return fuzzy.rank_candidates(word, candidates, max_distance)
+
+  # The term closest to word, word itself if indexed, or None.
+  def correct(self, word, max_distance=fuzzy.MAX_DISTANCE):
+    if self.has_term(word):
+      return word
+    suggestions = self.get_suggestions(word, max_distance)
+    return suggestions[0][0] if suggestions else None
+
+  # Returns {entry id: tf} for a term.
+  def get_postings(self, term):
+    return dict(self.db.execute('SELECT id, tf FROM postings WHERE term = ?',
+                                (term,)))
+
+  def get_lengths(self, entry_ids):
+    lengths = {}
+    entry_ids = list(entry_ids)
+    for i in range(0, len(entry_ids), 500):
+      chunk = entry_ids[i:i + 500]
+      lengths.update(self.db.execute(
+        'SELECT id, length FROM docs WHERE id IN (%s)' %
+        ','.join('?' * len(chunk)), chunk))
+    return lengths
+
+  # Returns {(entry id, field): positions} for a term.
+  def get_positions(self, term):
+    positions = {}
+    for entry_id, field, data in self.db.execute(
+        'SELECT id, field, positions FROM positions WHERE term = ?', (term,)):
+      p = array('I')
+      p.frombytes(data)
+      positions[(entry_id, field)] = p
+    return positions
+
+  # Positional postings of terms, restricted to the (entry id, field) pairs
+  # holding all of them. Rarer terms are intersected first.
+  def intersect_positions(self, terms):
+    postings = {t: self.get_positions(t) for t in set(terms)}
+    keys = None
+    for p in sorted(postings.values(), key=len):
+      keys = set(p) if keys is None else keys.intersection(p)
+      if not keys:
+        break
+    return postings, keys or set()
+
+  # Ids of the entries with the terms in sequence in the title or content.
+  def match_phrase(self, terms):
+    postings, keys = self.intersect_positions(terms)
+    matches = set()
+    for key in keys:
+      starts = set(postings[terms[0]][key])
+      for i, t in enumerate(terms[1:], 1):
+        starts.intersection_update(p - i for p in postings[t][key])
+        if not starts:
+          break
+      if starts:
+        matches.add(key[0])
+    return matches
+
+  # Ids of the entries with each pair of consecutive terms at most k tokens
+  # apart, in either order, in the title or content.
+  def match_near(self, terms, k):
+    postings, keys = self.intersect_positions(terms)
+    matches = set()
+    for key in keys:
+      if all(is_near(postings[t1][key], postings[t2][key], k)
+             for t1, t2 in zip(terms, terms[1:])):
+        matches.add(key[0])
+    return matches
+
+  # Restricts entry_ids (all entries if None) to those matching every
+  # phrase and NEAR clause of a query parsed by parse_query.
+  def match(self, clauses, entry_ids=None):
+    for op, terms, arg in clauses:
+      if op == 'phrase':
+        matches = self.match_phrase(terms)
+      elif op == 'near':
+        matches = self.match_near(terms, arg)
+      else:
+        continue
+      entry_ids = matches if entry_ids is None else matches.intersection(
+        entry_ids)
+    return entry_ids
+
+  # Runs a query parsed by parse_query, ranking the matching entries by all
+  # of its terms with scorer ('bm25' or 'inverse_frequency', which ignores
+  # title_boost).
+  def search(self, clauses, entry_ids=None, title_boost=1.0, k=None,
+             scorer='bm25'):
+    terms = [t for _, clause_terms, _ in clauses for t in clause_terms]
+    entry_ids = self.match(clauses, entry_ids)
+    if scorer == 'bm25':
+      return self.query(terms, entry_ids, title_boost, k)
+    if scorer == 'inverse_frequency':
+      return self.query_inverse_frequency(terms, entry_ids, k)
+    raise Exception('Invalid scorer %s' % scorer)
+
+  # Scores the entries containing any of the terms with BM25, counting each
+  # occurrence in the title title_boost times. Returns (score, entry id)
+  # pairs, best first and newest first among ties, restricted to entry_ids
+  # if given. With k, only the k best are returned (see top_k).
+  def query(self, terms, entry_ids=None, title_boost=1.0, k=None):
+    if k is not None:
+      return self.top_k(terms, k, entry_ids, title_boost)
+
+    num_docs, total_length = self.get_totals()
+    if num_docs == 0:
+      return []
+    avg_length = total_length / num_docs
+
+    postings = []
+    for t in set(terms):
+      postings.append({
+        entry_id: tf + (title_boost - 1) * title_tf
+        for entry_id, tf, title_tf in self.db.execute(
+          'SELECT id, tf, title_tf FROM postings WHERE term = ?', (t,))})
+    candidates = set()
+    for p in postings:
+      candidates.update(p)
+    if entry_ids is not None:
+      candidates &= set(entry_ids)
+    lengths = self.get_lengths(candidates)
+
+    # Sums are exactly rounded so they do not depend on the order of terms.
+    scores = {entry_id: [] for entry_id in candidates}
+    for p in postings:
+      idf = math.log(1 + (num_docs - len(p) + 0.5) / (len(p) + 0.5))
+      for entry_id in candidates.intersection(p):
+        tf = p[entry_id]
+        norm = K1 * (1 - B + B * lengths[entry_id] / avg_length)
+        scores[entry_id].append(idf * tf * (K1 + 1) / (tf + norm))
+    return sorted(((math.fsum(s), i) for i, s in scores.items()),
+                  key=lambda r: (-r[0], -r[1]))
+
+  # The k best results of query, found with max-score pruning. Each term's
+  # contribution is bounded using its max_tf and a zero length entry. Terms
+  # are sorted by bound, and once the k-th best score exceeds the sum of the
+  # smallest bounds, entries holding only those terms cannot make it into
+  # the results: their postings are no longer read, and their frequencies
+  # are only looked up for entries whose bound can still beat the k-th.
+  # Entries are visited in id order, so among equal scores the later one
+  # wins, as in query.
+  def top_k(self, terms, k, entry_ids=None, title_boost=1.0):
+    num_docs, total_length = self.get_totals()
+    if num_docs == 0 or k <= 0:
+      return []
+    avg_length = total_length / num_docs
+    if entry_ids is not None:
+      entry_ids = set(entry_ids)
+
+    scorers = []
+    for t in set(terms):
+      row = self.db.execute('SELECT df, max_tf FROM terms WHERE term = ?',
+                            (t,)).fetchone()
+      if row is None:
+        continue
+      df, max_tf = row
+      idf = math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+      max_tf *= max(title_boost, 1.0)
+      bound = idf * max_tf * (K1 + 1) / (max_tf + K1 * (1 - B))
+      scorers.append((bound, idf, t))
+    scorers.sort()
+
+    # bounds[i] is the sum of the bounds of the first i terms.
+    bounds = [0.0]
+    for bound, _, _ in scorers:
+      bounds.append(bounds[-1] + bound)
+
+    cursors = [self.db.execute('''
+      SELECT id, tf + ? * title_tf, length FROM postings JOIN docs USING (id)
+      WHERE term = ? ORDER BY id
+    ''', (title_boost - 1, t)) for _, _, t in scorers]
+    current = [next(c, None) for c in cursors]
+
+    heap = []
+    threshold = 0.0
+    first = 0 # Terms before first are not essential.
+    while True:
+      essential = [i for i in range(first, len(scorers))
+                   if current[i] is not None]
+      if not essential:
+        break
+      entry_id = min(current[i][0] for i in essential)
+
+      tfs = {}
+      for i in essential:
+        if current[i][0] == entry_id:
+          _, tfs[i], length = current[i]
+          current[i] = next(cursors[i], None)
+      if entry_ids is not None and entry_id not in entry_ids:
+        continue
+      if sum(scorers[i][0] for i in tfs) + bounds[first] < threshold:
+        continue
+
+      norm = K1 * (1 - B + B * length / avg_length)
+      parts = [scorers[i][1] * tf * (K1 + 1) / (tf + norm)
+               for i, tf in tfs.items()]
+      score = math.fsum(parts)
+      for i in range(first - 1, -1, -1):
+        if score + bounds[i + 1] < threshold:
+          break
+        row = self.db.execute('''
+          SELECT tf + ? * title_tf FROM postings WHERE term = ? AND id = ?
+        ''', (title_boost - 1, scorers[i][2], entry_id)).fetchone()
+        if row is not None:
+          tf = row[0]
+          parts.append(scorers[i][1] * tf * (K1 + 1) / (tf + norm))
+          score = math.fsum(parts)
+
+      if score <= 0.0:
+        continue
+      if len(heap) < k:
+        heapq.heappush(heap, (score, entry_id))
+      elif score >= heap[0][0]:
+        heapq.heapreplace(heap, (score, entry_id))
+      else:
+        continue
+      if len(heap) == k:
+        threshold = heap[0][0]
+        while first < len(scorers) and bounds[first + 1] < threshold:
+          first += 1
+
+    return sorted(heap, key=lambda r: (-r[0], -r[1]))
+
+  # The score of the search command before this index (see score_entries
+  # in benchmarks.suite): the sum of tf / cf ** 2 of the terms in an entry
+  # over the square root of that sum for all its terms.
+  # Only the postings of the terms and of the entries holding them are read.
+  # Returns (score, entry id) pairs like query.
+  def query_inverse_frequency(self, terms, entry_ids=None, k=None):
+    scores = {}
+    for t in set(terms):
+      for entry_id, weight in self.db.execute('''
+        SELECT id, CAST(tf AS REAL) / (cf * cf) FROM postings
+        JOIN terms USING (term) WHERE term = ?
+      ''', (t,)):
+        scores.setdefault(entry_id, []).append(weight)
+    if entry_ids is not None:
+      entry_ids = set(entry_ids)
+      scores = {i: s for i, s in scores.items() if i in entry_ids}
+
+    norms = {}
+    ids = list(scores)
+    for i in range(0, len(ids), 500):
+      chunk = ids[i:i + 500]
+      norms.update(self.db.execute('''
+        SELECT id, SUM(CAST(tf AS REAL) / (cf * cf)) FROM postings
+        JOIN terms USING (term) WHERE id IN (%s) GROUP BY id
+      ''' % ','.join('?' * len(chunk)), chunk))
+    results = sorted(((math.fsum(s) / math.sqrt(norms[i]), i)
+                      for i, s in scores.items()),
+                     key=lambda r: (-r[0], -r[1]))
+    return results if k is None else results[:k]
+
+# Results of a query, fetched as they are read: the first page_size with
+# the first request, then twice as many each time a read goes past the
+# results fetched so far. fetch(k) returns the k best results.
+class LazyResults:
+  def __init__(self, fetch, page_size=10):
+    self.fetch = fetch
+    self.k = page_size
+    self.results = fetch(page_size)
+
+  # True if all results have been fetched.
+  def is_complete(self):
+    return len(self.results) < self.k
+
+  def has(self, i):
+    while i >= len(self.results) and not self.is_complete():
+      self.k *= 2
+      self.results = self.fetch(self.k)
+    return i < len(self.results)
+
+  def __getitem__(self, i):
+    if not self.has(i):
+      raise IndexError(i)
+    return self.results[i]
+
+  def __len__(self):
+    return len(self.results)
+
+# True if some position in p1 is at most k away from one in p2. Positions
+# are sorted.
+def is_near(p1, p2, k):
+  for p in p1:
+    i = bisect.bisect_left(p2, p - k)
+    if i < len(p2) and p2[i] <= p + k:
+      return True
+  return False
+
+QUERY_RE = re.compile(r'"([^"]*)"?|(NEAR/\d+)(?!\S)|(\S+)')
+
+# Parses a search query into clauses of (op, terms, arg): ('phrase', terms,
+# None) for quoted text, ('near', terms, k) for words joined by NEAR/k, as
+# in 'docker NEAR/3 compose', and ('term', [term], None) for other words.
+def parse_query(q):
+  clauses = []
+  near = None
+  for phrase, operator, word in QUERY_RE.findall(q):
+    if operator:
+      near = int(operator[5:])
+      continue
+
+    if phrase:
+      tokens = tokenize(phrase)
+      if tokens:
+        clauses.append(('phrase', tokens, None))
+      near = None
+      continue
+
+    for t in tokenize(word):
+      prev = clauses[-1] if clauses else None
+      if near is None or prev is None or prev[0] == 'phrase':
+        clauses.append(('term', [t], None))
+      elif prev[0] == 'near' and prev[2] == near:
+        prev[1].append(t)
+      elif prev[0] == 'term':
+        clauses[-1] = ('near', prev[1] + [t], near)
+      else:
+        clauses.append(('near', [prev[1][-1], t], near))
+      near = None
+  return clauses
@@ -0,0 +1,162 @@
+import json
+import os
+import re
+import tempfile
+from logger.util import epoch_to_date, file_signature
+
+# Sharded layout of the data file. Entries are split into segment files, one
+# per top-level tag ('tag') or per month of modification ('month'), in the
+# same format as the entries of the data file. A manifest holds the tag
+# hierarchy and, for each shard, its file, entry count, range of modification
+# times and the tags of its entries, so a load can pick only the segments it
+# needs.
+#
+# Segment names carry a random token. Compaction writes a new set of segments
+# next to the old ones, replaces the manifest and only then removes the
+# segments the old manifest referenced.
+
+MANIFEST = 'manifest.json'
+FORMAT_VERSION = 1
+LAYOUTS = ('tag', 'month')
+
+def get_manifest_file(directory):
+  return os.path.join(directory, MANIFEST)
+
+def is_sharded(directory):
+  return os.path.isfile(get_manifest_file(directory))
+
+def read_manifest(directory):
+  with open(get_manifest_file(directory)) as f:
+    manifest = json.load(f)
+  if manifest.get('version') != FORMAT_VERSION:
+    raise Exception('Unsupported manifest version %s' % manifest.get('version'))
+  return manifest
+
+# Versions of the manifest and of every segment it references.
+def signature(directory):
+  manifest_signature = file_signature(get_manifest_file(directory))
+  try:
+    manifest = read_manifest(directory)
+  except (OSError, ValueError):
+    return (manifest_signature,)
+  return (manifest_signature,) + tuple(
+    file_signature(os.path.join(directory, s['file']))
+    for s in manifest['shards'])
+
+def shard_key(entry, by):
+  if by == 'month':
+    return epoch_to_date(entry.modified_ts).strftime('%Y-%m')
+
+  tag = entry.category
+  while tag.parent is not None and tag.parent.parent is not None:
+    tag = tag.parent
+  return tag.name
+
+# Tag records in the order the data file lists them, as read by
+# Logger.load_tags.
+def tag_records(tag, indents=0):
+  records = []
+  for c in tag.children:
+    if c.name == 'other':
+      continue
+    records.append((indents, c.name, c.id))
+    records += tag_records(c, indents + 1)
+  return records
+
+# Splits the entries of a fully loaded logger into segments. Returns the tag
+# records and a list of (key, text, stats) sorted by key. Line numbers of the
+# entries are updated to point into their segment.
+def render(logger, by):
+  if by not in LAYOUTS:
+    raise Exception('Invalid shard layout %s' % by)
+
+  groups = {}
+  for e in logger.get_entries():
+    groups.setdefault(shard_key(e, by), []).append(e)
+
+  segments = []
+  for key in sorted(groups):
+    entries = groups[key]
+    parts = []
+    line_num = 1
+    for e in entries:
+      s = str(e)
+      e.line_num = line_num
+      line_num += s.count('\n')
+      parts.append(s)
+
+    segments.append((key, ''.join(parts), {
+      'key': key,
+      'entries': len(entries),
+      'min_modified_ts': entries[0].modified_ts,
+      'max_modified_ts': entries[-1].modified_ts,
+      'tags': sorted({e.category_id for e in entries}),
+    }))
+  return tag_records(logger.main_tag), segments
+
+def write_file(path, text):
+  fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+  with os.fdopen(fd, 'w') as f:
+    f.write(text)
+    f.flush()
+    os.fsync(f.fileno())
+  os.replace(tmp, path)
+
+# Writes the segments returned by render under new names and returns the
+# manifest referencing them. Nothing is visible to readers until commit.
+def write(directory, by, tags, segments):
+  os.makedirs(directory, exist_ok=True)
+  token = os.urandom(4).hex()
+  shards = []
+  for i, (key, text, stats) in enumerate(segments):
+    name = '%04d-%s.%s.txt' % (i, re.sub(r'[^\w-]', '_', key), token)
+    write_file(os.path.join(directory, name), text)
+    shards.append(dict(stats, file=name))
+  return {'version': FORMAT_VERSION, 'by': by, 'tags': tags, 'shards': shards}
+
+def remove_segments(directory, manifest):
+  for s in manifest['shards']:
+    try:
+      os.remove(os.path.join(directory, s['file']))
+    except FileNotFoundError:
+      pass
+
+# Makes manifest current and removes the segments of the previous one.
+def commit(directory, manifest):
+  old = read_manifest(directory) if is_sharded(directory) else None
+  write_file(get_manifest_file(directory), json.dumps(manifest))
+  if old is not None:
+    current = {s['file'] for s in manifest['shards']}
+    old['shards'] = [s for s in old['shards'] if s['file'] not in current]
+    remove_segments(directory, old)
+
+# Removes the manifest and all segments.
+def remove(directory):
+  if is_sharded(directory):
+    remove_segments(directory, read_manifest(directory))
+    os.remove(get_manifest_file(directory))
+  try:
+    os.rmdir(directory)
+  except OSError:
+    pass
+
+# Shards holding entries of the given tag ids.
+def select_tags(manifest, tag_ids):
+  return [s for s in manifest['shards'] if tag_ids.intersection(s['tags'])]
+
+# Shards that may hold one of the n most recently modified entries, given
+# the modification time of the n-th most recent entry loaded so far (None if
+# fewer than n were loaded).
+def select_latest(manifest, n, threshold=None):
+  shards = sorted(manifest['shards'], key=lambda s: -s['max_modified_ts'])
+  if threshold is not None:
+    return [s for s in shards if s['max_modified_ts'] >= threshold]
+
+  selected = []
+  count = 0
+  for s in shards:
+    if count >= n:
+      break
+    selected.append(s)
+    count += s['entries']
+  return selected
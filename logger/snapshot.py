@@ -0,0 +1,81 @@
+import hashlib
+import marshal
+import os
+import struct
+import tempfile
+
+# Binary snapshot of the parsed tag and entry records of a data file, so a
+# warm start can skip parsing. The header identifies the source file by size,
+# mtime and SHA-1 of its content. Bumping FORMAT_VERSION (or running under a
+# Python with a different marshal version) invalidates existing snapshots.
+#
+# Lazy snapshots (the offset index) hold the byte range of each entry's
+# content instead of its lines. They are checked by size and mtime only, as
+# hashing would read the whole file they exist to avoid reading.
+
+MAGIC = b'JLSNAP\n'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<HHQq20s')
+
+def get_snapshot_file(path, lazy=False):
+  head, tail = os.path.split(path)
+  return os.path.join(head, '.%s.%s' % (tail, 'index' if lazy else 'snapshot'))
+
+def hash_file(path):
+  h = hashlib.sha1()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(1 << 20), b''):
+      h.update(chunk)
+  return h.digest()
+
+def read_header(f):
+  if f.read(len(MAGIC)) != MAGIC:
+    return None
+  data = f.read(HEADER.size)
+  if len(data) != HEADER.size:
+    return None
+  return HEADER.unpack(data)
+
+# Returns (tag_records, entry_records) if there is a valid snapshot for the
+# data file at path, otherwise None. The file is checked against st if given.
+def load(path, lazy=False, st=None):
+  try:
+    st = os.stat(path) if st is None else st
+    with open(get_snapshot_file(path, lazy), 'rb') as f:
+      header = read_header(f)
+      if header is None:
+        return None
+
+      version, marshal_version, size, mtime, digest = header
+      if (version != FORMAT_VERSION or marshal_version != marshal.version or
+          size != st.st_size or mtime != st.st_mtime_ns):
+        return None
+      if not lazy and digest != hash_file(path):
+        return None
+      return marshal.loads(f.read())
+  except (OSError, EOFError, ValueError, TypeError):
+    return None
+
+# Writes a snapshot for the records parsed from path. Signature is the
+# file signature taken before parsing; nothing is written if the file has
+# changed since.
+def save(path, signature, tags, entries, lazy=False):
+  st = os.stat(path)
+  digest = bytes(20) if lazy else hash_file(path)
+  if (st.st_ino, st.st_size, st.st_mtime_ns) != signature:
+    return False
+
+  snapshot_file = get_snapshot_file(path, lazy)
+  fd, tmp = tempfile.mkstemp(dir=os.path.dirname(snapshot_file))
+  try:
+    with os.fdopen(fd, 'wb') as f:
+      f.write(MAGIC)
+      f.write(HEADER.pack(FORMAT_VERSION, marshal.version, st.st_size,
+                          st.st_mtime_ns, digest))
+      marshal.dump((tags, entries), f)
+    os.replace(tmp, snapshot_file)
+  except OSError:
+    if os.path.exists(tmp):
+      os.remove(tmp)
+    return False
+  return True
@@ -1,29 +1,156 @@
 import datetime
-from logger.util import date_to_str
-
-# Category node that contains log entries.
+import heapq
+from logger.util import date_to_epoch, date_to_str, epoch_to_date
+
+def entry_modified_ts(entry):
+  return entry.modified_ts
+
+# Category node that contains log entries. total_entries counts the entries
+# in the subtree and modified_ts is the epoch second of the latest
+# modification in it. Both are kept exact as entries and children are added
+# and removed, or computed at once by aggregate after a bulk load.
+#
+# subtree_entries caches the entries of the subtree, newest first. It is
+# built by merging the cached runs of the children with the tag's own and
+# dropped up the ancestor path whenever an entry or child below changes. A
+# tag with a cache always has cached descendants, so invalidating can stop
+# at the first ancestor without one.
+#
+# The tag's own entries are a dict by id in insertion order, so adding,
+# removing and moving entries is O(1) apart from the walk up the ancestors.
+# When the latest entry of a tag is removed, the next one comes from a heap
+# of (-modified_ts, id) built on first use, whose items for entries no
+# longer in the tag are dropped as they reach the top.
+#
+# order is the SortedIndex of the tags of a Logger by order_key, if built
+# (see Logger.get_tags). The tag moves in it as its modified_ts changes.
 class Tag:
-  def __init__(self, id, name, entries):
+  __slots__ = ('id', 'name', '_modified_ts', 'entries', 'children', 'parent',
+               'total_entries', 'subtree_entries', 'latest', 'order')
+
+  def __init__(self, id, name):
     self.id = id
     self.name = name
-    self.modified_at = datetime.datetime(year=1970, month=1, day=1)
-    self.entries = entries
+    self.order = None
+    self._modified_ts = 0
+    self.entries = {}
+    self.latest = None
     self.children = []
     self.parent = None
     self.total_entries = 0
+    self.subtree_entries = None
+
+  @property
+  def modified_ts(self):
+    return self._modified_ts
+
+  @modified_ts.setter
+  def modified_ts(self, modified_ts):
+    if self.order is None or modified_ts == self._modified_ts:
+      self._modified_ts = modified_ts
+      return
+    self.order.remove(self.order_key())
+    self._modified_ts = modified_ts
+    self.order.insert(self.order_key(), self)
+
+  # Modification time, then id.
+  def order_key(self):
+    return (self._modified_ts << 32) | self.id
+
+  @property
+  def modified_at(self):
+    return epoch_to_date(self.modified_ts)
+
+  @modified_at.setter
+  def modified_at(self, date):
+    self.modified_ts = date_to_epoch(date)
+
+  def invalidate(self):
+    tag = self
+    while tag is not None and tag.subtree_entries is not None:
+      tag.subtree_entries = None
+      tag = tag.parent
+
+  # Adds count entries, the latest modified at modified_ts, to the
+  # aggregates of the tag and its ancestors.
+  def add_to_totals(self, count, modified_ts):
+    tag = self
+    while tag is not None:
+      tag.total_entries += count
+      if tag.modified_ts < modified_ts:
+        tag.modified_ts = modified_ts
+      tag = tag.parent
+
+  # Removes count entries from the aggregates of the tag and its ancestors.
+  # Modification times are recomputed where the latest one may be gone.
+  def remove_from_totals(self, count, modified_ts):
+    tag = self
+    while tag is not None:
+      tag.total_entries -= count
+      if tag.modified_ts <= modified_ts:
+        tag.refresh_modified_ts()
+      tag = tag.parent
+
+  # Modification time of the latest of the tag's own entries.
+  def latest_entry_ts(self):
+    if self.latest is None or len(self.latest) > 2 * len(self.entries) + 16:
+      self.latest = [(-e.modified_ts, e.id) for e in self.entries.values()]
+      heapq.heapify(self.latest)
+
+    while self.latest:
+      modified_ts, entry_id = self.latest[0]
+      entry = self.entries.get(entry_id)
+      if entry is not None and entry.modified_ts == -modified_ts:
+        return -modified_ts
+      heapq.heappop(self.latest)
+    return 0
+
+  def refresh_modified_ts(self):
+    modified_ts = self.latest_entry_ts()
+    for c in self.children:
+      if modified_ts < c.modified_ts:
+        modified_ts = c.modified_ts
+    self.modified_ts = modified_ts
+
+  # Computes the aggregates of the subtree in one post-order pass.
+  def aggregate(self):
+    total_entries = len(self.entries)
+    modified_ts = 0
+    for e in self.entries.values():
+      if modified_ts < e.modified_ts:
+        modified_ts = e.modified_ts
+
+    for c in self.children:
+      c.aggregate()
+      total_entries += c.total_entries
+      if modified_ts < c.modified_ts:
+        modified_ts = c.modified_ts
+    self.total_entries = total_entries
+    self.modified_ts = modified_ts
 
   def add_child(self, child):
+    self.invalidate()
     self.children.append(child)
+    self.add_to_totals(child.total_entries, child.modified_ts)
+
+  # Adds an entry without updating the aggregates, for bulk loads.
+  def attach_entry(self, entry):
+    self.invalidate()
+    self.entries[entry.id] = entry
+    entry.category_id = self.id
+    if self.latest is not None:
+      heapq.heappush(self.latest, (-entry.modified_ts, entry.id))
 
   def add_entry(self, entry):
-    self.entries.append(entry)
-    entry.category = self
-    parent = self
-    while parent is not None:
-      parent.total_entries += 1
-      if parent.modified_at < entry.modified_at:
-        parent.modified_at = entry.modified_at
-      parent = parent.parent
+    self.attach_entry(entry)
+    self.add_to_totals(1, entry.modified_ts)
+
+  def remove_entry(self, entry):
+    if self.entries.get(entry.id) is not entry:
+      return
+    self.invalidate()
+    del self.entries[entry.id]
+    self.remove_from_totals(1, entry.modified_ts)
 
   def get_child_tags(self):
     tags = []
@@ -35,21 +162,33 @@ class Tag:
       tags.append(current)
       queue += current.children
 
-    tags.sort(key=lambda t: t.modified_at, reverse=True)
+    tags.sort(key=lambda t: t.modified_ts, reverse=True)
     return tags
 
+  # Entries in the subtree, newest first, in time proportional to their
+  # number once cached.
+  def iter_entries(self):
+    if self.subtree_entries is None:
+      # Sorting the concatenated runs merges them, as timsort finds them.
+      entries = list(self.entries.values())
+      for c in self.children:
+        entries += c.iter_entries()
+      entries.sort(key=entry_modified_ts, reverse=True)
+      self.subtree_entries = entries
+    return iter(self.subtree_entries)
+
   def get_entries(self):
-    entries = []
-    for t in self.get_child_tags():
-      entries += t.entries
+    return list(self.iter_entries())
 
-    entries.sort(key=lambda e: e.modified_at, reverse=True)
-    return entries
+  def get_entry_ids(self):
+    return [e.id for e in self.iter_entries()]
 
   def delete_child(self, child_id):
     for i, c in enumerate(self.children):
       if int(c.id) == int(child_id):
+        self.invalidate()
         del self.children[i]
+        self.remove_from_totals(c.total_entries, c.modified_ts)
         return
     raise Exception('Child with id %d for tag %s does not exist' % 
                     (child_id, self.name))
@@ -59,7 +198,7 @@ class Tag:
       'id': self.id,
       'name': self.name,
       'children': [t.id for t in self.children],
-      'entries': [e.id for e in self.get_entries()],
+      'entries': self.get_entry_ids(),
       'total_entries': self.total_entries,
       'modified_at': date_to_str(self.modified_at - datetime.timedelta(hours=3)),
     }
@@ -74,18 +213,19 @@ class Tag:
     self.print_header()
 
     entries_to_print = 3
+    entries = list(self.entries.values())
 
-    if self.entries:
-      self.entries[-1].print_detailed(print_tags=False)
+    if entries:
+      entries[-1].print_detailed(print_tags=False)
 
-    for e in reversed(self.entries[-entries_to_print:-1]):
+    for e in reversed(entries[-entries_to_print:-1]):
       e.print_summarized(print_tags=False)
     print('\n')
 
   def print_snippet(self):
     dt = 'no entries'
     if self.entries:
-      e = self.entries[0]
+      e = next(iter(self.entries.values()))
       dt = datetime.datetime.strftime(e.created_at, "%Y-%m-%d %H:%M:%S")
     print('%s: %d (%s)' % (self.name, len(self.entries), dt))
 
@@ -96,6 +236,6 @@ class Tag:
       print('============================================')
       t.print_snippet()
       print('============================================')
-      for e in t.entries:
+      for e in t.entries.values():
         e.print_detailed()
 
@@ -1,4 +1,8 @@
+import contextlib
 import datetime
+import fcntl
+import gc
+import os
 
 DATE_PATTERN = "%Y-%m-%d %H:%M:%S"
 
@@ -14,3 +18,42 @@ def strip_lines(lines):
   if len(lines) > 0 and len(lines[-1]) == 0:
     lines = lines[:-1]
   return lines
+
+# Identifies a version of a file on disk. Returns None if the file is missing.
+def file_signature(path):
+  try:
+    st = os.stat(path)
+  except FileNotFoundError:
+    return None
+  return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+# Exclusive advisory lock between processes. Only writers take it.
+@contextlib.contextmanager
+def file_lock(path):
+  with open(path, 'a') as f:
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    try:
+      yield
+    finally:
+      fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+EPOCH = datetime.datetime(year=1970, month=1, day=1)
+ONE_SECOND = datetime.timedelta(seconds=1)
+
+def date_to_epoch(date):
+  return (date - EPOCH) // ONE_SECOND
+
+def epoch_to_date(seconds):
+  return EPOCH + datetime.timedelta(seconds=seconds)
+
+# Loading allocates millions of objects that are all still alive afterwards,
+# so running the cyclic garbage collector meanwhile is wasted work.
+@contextlib.contextmanager
+def gc_paused():
+  enabled = gc.isenabled()
+  gc.disable()
+  try:
+    yield
+  finally:
+    if enabled:
+      gc.enable()
@@ -0,0 +1,1121 @@
+#!/usr/local/bin/python3
+
+import datetime
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks import suite
+from benchmarks.corpus import generate_corpus
+from logger import fuzzy
+from logger import jlogger
+from logger import journal
+from logger import parser
+from logger import querycache
+from logger import search
+from logger import shards
+from logger import snapshot
+from logger.cache import SharedLogger
+from logger.content import ContentStore
+from logger.entry import tokenize
+from logger.ordered import SortedIndex
+from logger.util import epoch_to_date
+
+# The web views are only tested where Django is installed.
+try:
+  import django
+  import rest_framework
+except ImportError:
+  django = None
+
+SAMPLE = '''programming 2
+  python 3
+  docker 4
+books 5
+
+K00000001 [2020-01-01 10:00:00|2020-01-01 10:00:00] (python) Decorators
+
+Decorators wrap functions.
+
+K00000002 [2020-01-02 10:00:00|2020-01-03 11:30:00] (docker) Docker compose
+
+Use docker compose up -d
+to start services.
+
+K00000003 [2020-01-04 09:00:00|2020-01-04 09:00:00] (other) Untagged entry
+
+K00000004 [2020-01-05 08:00:00|2020-01-06 08:00:00] (books) Reading list
+
+Dune
+
+'''
+
+class LoggerTestCase(unittest.TestCase):
+  def setUp(self):
+    self.data_path = tempfile.mkdtemp()
+    self.orig_data_path = jlogger.DATA_PATH
+    jlogger.DATA_PATH = self.data_path
+    self.write_data(SAMPLE)
+
+  def tearDown(self):
+    jlogger.DATA_PATH = self.orig_data_path
+    shutil.rmtree(self.data_path)
+
+  def write_data(self, content):
+    with open(jlogger.get_data_file(), 'w') as f:
+      f.write(content)
+
+  def read_data(self):
+    with open(jlogger.get_data_file()) as f:
+      return f.read()
+
+class LoggerTest(LoggerTestCase):
+  def test_load(self):
+    logger = jlogger.Logger()
+    self.assertEqual(4, len(logger.entries_by_id))
+    self.assertEqual(['python', 'docker'],
+                     [t.name for t in logger.get_tag_by_name('programming').children])
+
+    e = logger.get_entry_by_id(2)
+    self.assertEqual('Docker compose', e.title.strip())
+    self.assertEqual('docker', e.category.name)
+    self.assertEqual(['Use docker compose up -d', 'to start services.'], e.content)
+    self.assertEqual('other', logger.get_entry_by_id(3).category.name)
+    self.assertEqual(2, logger.get_tag_by_name('programming').total_entries)
+    self.assertEqual(4, logger.main_tag.total_entries)
+
+  def test_compact_round_trip(self):
+    logger = jlogger.Logger()
+    logger.compact()
+    self.assertEqual(SAMPLE, self.read_data())
+
+  def test_is_stale(self):
+    logger = jlogger.Logger()
+    self.assertFalse(logger.is_stale())
+    logger.create_entry('New entry', 5)
+    logger.save()
+    self.assertFalse(logger.is_stale())
+    self.write_data(SAMPLE.replace('Dune', 'Dune\nEmma'))
+    self.assertTrue(logger.is_stale())
+
+class SubtreeIndexTest(LoggerTestCase):
+  def assert_consistent(self, logger):
+    for tag in logger.get_tags():
+      subtree = {t.id for t in tag.get_child_tags()}
+      expected = [e for e in logger.entries_by_id.values()
+                  if e.category_id in subtree]
+      expected.sort(key=lambda e: e.modified_ts, reverse=True)
+      self.assertEqual([e.modified_ts for e in expected],
+                       [e.modified_ts for e in tag.get_entries()])
+      self.assertEqual(sorted(e.id for e in expected),
+                       sorted(tag.get_entry_ids()))
+      self.assertEqual(len(expected), tag.total_entries)
+      self.assertEqual(max([e.modified_ts for e in expected], default=0),
+                       tag.modified_ts)
+
+  def test_get_entries(self):
+    logger = jlogger.Logger()
+    self.assertEqual([2, 1], logger.get_tag_by_name('programming').get_entry_ids())
+    self.assertEqual([4, 3, 2, 1], logger.main_tag.get_entry_ids())
+    self.assert_consistent(logger)
+
+  def test_mutations(self):
+    logger = jlogger.Logger()
+    self.assert_consistent(logger)
+    logger.create_entry('New entry', 3)
+    self.assert_consistent(logger)
+    logger.edit_entry({'id': 4, 'tag': 'docker'})
+    self.assert_consistent(logger)
+    self.assertIn(4, logger.get_tag_by_name('programming').get_entry_ids())
+    logger.delete_entry(2)
+    self.assert_consistent(logger)
+    tag = logger.create_tag(5)
+    logger.edit_tag({'id': 3, 'parent': tag.id})
+    self.assert_consistent(logger)
+    self.assertIn(1, logger.get_tag_by_name('books').get_entry_ids())
+    logger.delete_tag(tag.id)
+    self.assert_consistent(logger)
+    logger.delete_entry(4)
+    self.assert_consistent(logger)
+
+  def test_retagging(self):
+    logger = jlogger.Logger()
+    for tag in ['docker', 'books', 'python', 'books']:
+      logger.edit_entry({'id': 1, 'tag': tag})
+      self.assert_consistent(logger)
+    self.assertEqual([4, 1], list(logger.get_tag_by_name('books').entries))
+    self.assertEqual([], list(logger.get_tag_by_name('python').entries))
+
+    # An unknown tag leaves the entry where it was.
+    with self.assertRaises(Exception):
+      logger.edit_entry({'id': 1, 'tag': 'missing'})
+    self.assert_consistent(logger)
+    self.assertEqual(4, logger.main_tag.total_entries)
+
+    # Removing the latest entry of a tag falls back to the previous one.
+    logger.delete_entry(1)
+    self.assert_consistent(logger)
+    logger.delete_entry(4)
+    self.assert_consistent(logger)
+    self.assertEqual(0, logger.get_tag_by_name('books').modified_ts)
+
+  def test_journal_replay(self):
+    logger = jlogger.Logger()
+    logger.edit_tag({'id': 4, 'parent': 5})
+    logger.delete_entry(1)
+    logger.save()
+    self.assert_consistent(jlogger.Logger())
+
+class RecencyIndexTest(LoggerTestCase):
+  def test_sorted_index(self):
+    rnd = random.Random(0)
+    index = SortedIndex([(k, str(k)) for k in range(0, 100, 2)], load=4)
+    expected = set(range(0, 100, 2))
+    for _ in range(500):
+      key = rnd.randrange(100)
+      if key in expected:
+        self.assertEqual(str(key), index.remove(key))
+        expected.remove(key)
+      else:
+        index.insert(key, str(key))
+        expected.add(key)
+      self.assertEqual(sorted(expected), [k for k, _ in index.iter_items()])
+
+    keys = sorted(expected)
+    self.assertEqual(len(keys), len(index))
+    self.assertIsNone(index.remove(1000))
+    self.assertEqual([str(k) for k in keys], index.get_values())
+    self.assertEqual(keys[::-1], [k for k, _ in index.iter_items(True)])
+    self.assertEqual([k for k in keys if k > 50],
+                     [k for k, _ in index.iter_items(start=50)])
+    self.assertEqual([k for k in reversed(keys) if k < 50],
+                     [k for k, _ in index.iter_items(True, 50)])
+
+  def test_latest_entries(self):
+    logger = jlogger.Logger()
+    self.assertEqual([1, 2, 3, 4], [e.id for e in logger.get_entries()])
+    entries, cursor = logger.get_latest_entries(3)
+    self.assertEqual([4, 3, 2], [e.id for e in entries])
+    entries, cursor = logger.get_latest_entries(3, cursor)
+    self.assertEqual([1], [e.id for e in entries])
+    self.assertIsNone(cursor)
+
+    logger.edit_entry({'id': 1, 'title': 'Edited'})
+    logger.delete_entry(3)
+    self.assertEqual([2, 4, 1], [e.id for e in logger.get_entries()])
+    self.assertEqual([1], [e.id for e in logger.get_latest_entries(1)[0]])
+    tags = logger.get_tags()
+    self.assertEqual(sorted(tags, key=lambda t: -t.modified_ts), tags)
+    self.assertEqual(logger.get_entry_by_id(1).modified_ts,
+                     logger.get_tag_by_name('python').modified_ts)
+
+  def test_tag_order(self):
+    logger = jlogger.Logger()
+    def expected():
+      return sorted(logger.tags_by_id.values(),
+                    key=lambda t: (-t.modified_ts, -t.id))
+    self.assertEqual(expected(), logger.get_tags())
+
+    tag = logger.create_tag(5)
+    for mutate in [lambda: logger.edit_entry({'id': 1, 'title': 'Edited'}),
+                   lambda: logger.create_entry('New', tag.id),
+                   lambda: logger.edit_tag({'id': 4, 'parent': tag.id}),
+                   lambda: logger.delete_entry(4),
+                   lambda: logger.delete_tag(5)]:
+      mutate()
+      self.assertEqual(expected(), logger.get_tags())
+    self.assertEqual(len(logger.tags_by_id), len(logger.tag_order))
+
+class SecondaryIndexTest(LoggerTestCase):
+  def ids(self, entries):
+    return [e.id for e in entries]
+
+  def test_title(self):
+    logger = jlogger.Logger()
+    self.assertEqual([2], self.ids(logger.get_entries_by_title('docker COMPOSE ')))
+    logger.edit_entry({'id': 2, 'title': 'Compose'})
+    self.assertEqual([], logger.get_entries_by_title('docker compose'))
+    self.assertEqual([2], self.ids(logger.get_entries_by_title('compose')))
+    logger.delete_entry(2)
+    self.assertEqual([], logger.get_entries_by_title('compose'))
+
+  def test_ranges(self):
+    logger = jlogger.Logger()
+    date = datetime.datetime
+    self.assertEqual([2, 3], self.ids(logger.get_entries_between(
+      date(2020, 1, 2), date(2020, 1, 5))))
+    self.assertEqual([3, 4], self.ids(logger.get_entries_between(
+      date(2020, 1, 4), field='modified')))
+    self.assertEqual([1], self.ids(logger.get_entries_between(
+      until=date(2020, 1, 2))))
+
+    logger.edit_entry({'id': 3, 'title': 'Edited'})
+    self.assertEqual([4], self.ids(logger.get_entries_between(
+      date(2020, 1, 4), date(2021, 1, 1), field='modified')))
+    self.assertEqual([3], self.ids(logger.get_entries_between(
+      date(2020, 1, 4), date(2020, 1, 5))))
+
+  def test_category_and_tag_deletion(self):
+    logger = jlogger.Logger()
+    self.assertEqual([2], self.ids(logger.get_entries_by_category(4)))
+    self.assertEqual([2, 1], self.ids(logger.get_entries_by_category(2, True)))
+    logger.delete_tag(2)
+    self.assertEqual([3, 4], self.ids(logger.get_entries_between()))
+    self.assertEqual([], logger.get_entries_by_title('decorators'))
+
+class TagPrefixTest(LoggerTestCase):
+  def test_complete(self):
+    logger = jlogger.Logger()
+    self.assertEqual(['programming', 'python'], logger.complete_tag_name('p'))
+    self.assertEqual(['programming'], logger.complete_tag_name('p', 1))
+    self.assertEqual([], logger.complete_tag_name('z'))
+
+    tag = logger.create_tag(2)
+    logger.edit_tag({'id': tag.id, 'name': 'pytest'})
+    self.assertEqual(['pytest', 'python'], logger.complete_tag_name('pyt'))
+    logger.delete_tag(3)
+    self.assertEqual(['pytest'], logger.complete_tag_name('py'))
+
+  def test_resolve(self):
+    logger = jlogger.Logger()
+    self.assertEqual('docker', logger.resolve_tag('dock').name)
+    self.assertEqual('books', logger.resolve_tag('books').name)
+    with self.assertRaises(Exception):
+      logger.resolve_tag('p')
+    with self.assertRaises(Exception):
+      logger.resolve_tag('z')
+
+  def test_find(self):
+    logger = jlogger.Logger()
+    self.assertEqual('docker', logger.find_tag('dock').name)
+    self.assertIsNone(logger.find_tag('p'))
+    self.assertIsNone(logger.find_tag('z'))
+
+class JournalTest(LoggerTestCase):
+  def test_save_appends_to_journal(self):
+    logger = jlogger.Logger()
+    e = logger.create_entry('New entry', 5)
+    logger.edit_entry({'id': e.id, 'content': 'Line 1\nLine 2'})
+    logger.save()
+
+    self.assertEqual(SAMPLE, self.read_data())
+    with journal.open_journal(jlogger.get_data_file()) as f:
+      records = list(journal.read(f))
+    self.assertEqual(['entry', 'entry'], [r['op'] for r in records])
+
+    logger = jlogger.Logger()
+    e = logger.get_entry_by_id(e.id)
+    self.assertEqual(['Line 1', 'Line 2'], e.content)
+    self.assertEqual('books', e.category.name)
+
+  def test_replay_tags_and_deletions(self):
+    logger = jlogger.Logger()
+    tag = logger.create_tag(5)
+    logger.edit_tag({'id': tag.id, 'name': 'novels', 'parent': 2})
+    logger.delete_entry(1)
+    logger.delete_tag(4)
+    logger.save()
+
+    logger = jlogger.Logger()
+    self.assertEqual(['python', 'novels'],
+                     [t.name for t in logger.get_tag_by_name('programming').children])
+    self.assertEqual([3, 4], sorted(logger.entries_by_id))
+    self.assertNotIn('docker', logger.tags_by_name)
+
+  def test_rename_to_existing_name(self):
+    logger = jlogger.Logger()
+    with self.assertRaises(Exception):
+      logger.edit_tag({'id': 4, 'name': 'python'})
+    self.assertEqual('docker', logger.get_tag_by_id(4).name)
+    self.assertIs(logger.get_tag_by_id(3), logger.get_tag_by_name('python'))
+    self.assertEqual([], logger.pending)
+
+    logger.delete_tag(3)
+    logger.save()
+    self.assertNotIn('python', jlogger.Logger().tags_by_name)
+
+  def test_compaction(self):
+    logger = jlogger.Logger()
+    logger.edit_entry({'id': 1, 'title': 'Renamed'})
+    logger.save()
+    logger.compact()
+
+    self.assertFalse(os.path.exists(journal.get_journal_file(jlogger.get_data_file())))
+    self.assertIn('(python) Renamed\n', self.read_data())
+    self.assertFalse(logger.is_stale())
+
+    e = jlogger.Logger().get_entry_by_id(1)
+    self.assertEqual('Renamed', e.title.strip())
+    self.assertEqual(e.line_num, logger.get_entry_by_id(1).line_num)
+
+  # A reader that opened the journal before a compaction replays it over
+  # the compacted data file.
+  def test_replay_over_compacted_file(self):
+    logger = jlogger.Logger()
+    tag = logger.create_tag(3)
+    logger.edit_tag({'id': tag.id, 'name': 'asyncio'})
+    entry = logger.create_entry('Event loops', tag.id)
+    logger.delete_tag(2)
+    logger.save()
+    journal_file = journal.get_journal_file(jlogger.get_data_file())
+    with open(journal_file) as f:
+      records = f.read()
+    logger.compact()
+    compacted = self.read_data()
+
+    with open(journal_file, 'w') as f:
+      f.write(records)
+    logger = jlogger.Logger()
+    self.assertEqual([3, 4], sorted(logger.entries_by_id))
+    self.assertNotIn(entry.id, logger.entries_by_id)
+    self.assertNotIn('asyncio', logger.tags_by_name)
+    self.assertNotIn('programming', logger.tags_by_name)
+    self.assertEqual(compacted, logger.render())
+
+  def test_load_racing_compaction(self):
+    logger = jlogger.Logger()
+    logger.edit_entry({'id': 1, 'title': 'Closures'})
+    logger.delete_tag(3)
+    logger.save()
+
+    orig_open_journal = journal.open_journal
+    def open_journal(path):
+      f = orig_open_journal(path)
+      if f is not None:
+        journal.open_journal = orig_open_journal
+        logger.compact()
+      return f
+    journal.open_journal = open_journal
+    try:
+      loaded = jlogger.Logger()
+    finally:
+      journal.open_journal = orig_open_journal
+    self.assertEqual(logger.signature, loaded.signature)
+    self.assertEqual([2, 3, 4], sorted(loaded.entries_by_id))
+    self.assertFalse(loaded.is_stale())
+
+  def test_threshold_triggers_compaction(self):
+    orig_threshold = jlogger.JOURNAL_THRESHOLD
+    jlogger.JOURNAL_THRESHOLD = 0
+    try:
+      logger = jlogger.Logger()
+      logger.create_entry('New entry', 5)
+      logger.save()
+    finally:
+      jlogger.JOURNAL_THRESHOLD = orig_threshold
+    self.assertIn('New entry', self.read_data())
+
+  def test_interrupted_append_is_ignored(self):
+    logger = jlogger.Logger()
+    logger.delete_entry(1)
+    logger.save()
+    with open(journal.get_journal_file(jlogger.get_data_file()), 'a') as f:
+      f.write('{"op": "delete_entry", "id": 2')
+
+    logger = jlogger.Logger()
+    self.assertEqual([2, 3, 4], sorted(logger.entries_by_id))
+
+class ParserTest(unittest.TestCase):
+  def test_decode_timestamp(self):
+    self.assertEqual(jlogger.datetime.datetime(2020, 1, 3, 11, 30, 5),
+                     epoch_to_date(parser.decode_timestamp('2020-01-03 11:30:05')))
+
+  def test_iter_entries(self):
+    lines = parser.numbered_lines([
+      'a 2\n', '  b 3\n', '\n', 'ignored\n',
+      'K00000001 [2020-01-01 10:00:00|2020-01-02 10:00:00] (B|a) Title\n',
+      '\n', 'Kx\n', 'text  \n', '\n',
+      'K00000002 [2020-01-01 10:00:00|2020-01-01 10:00:00] Untagged\n',
+    ])
+    self.assertEqual([(0, 'a', 2), (1, 'b', 3)],
+                     list(parser.iter_tags(lines)))
+
+    entries = list(parser.iter_entries(lines))
+    self.assertEqual(2, len(entries))
+    entry_id, _, modified_at, title, tags, content, line_num = entries[0]
+    self.assertEqual((1, ' Title', ['b', 'a'], ['Kx', 'text'], 5),
+                     (entry_id, title, tags, content, line_num))
+    self.assertEqual(2, epoch_to_date(modified_at).day)
+    self.assertEqual(('Untagged', [], []), entries[1][3:6])
+
+class ParallelParseTest(LoggerTestCase):
+  def setUp(self):
+    super().setUp()
+    self.orig_threshold = jlogger.PARALLEL_THRESHOLD
+    jlogger.PARALLEL_THRESHOLD = 0
+
+  def tearDown(self):
+    jlogger.PARALLEL_THRESHOLD = self.orig_threshold
+    super().tearDown()
+
+  def assert_same_as_sequential(self):
+    expected = jlogger.Logger(workers=1)
+    actual = jlogger.Logger(workers=3)
+    self.assertEqual(
+      [(str(e), e.line_num, e.category.name) for e in expected.get_entries()],
+      [(str(e), e.line_num, e.category.name) for e in actual.get_entries()])
+    self.assertEqual(
+      [(t.name, t.parent and t.parent.name, t.total_entries)
+       for t in expected.get_tags()],
+      [(t.name, t.parent and t.parent.name, t.total_entries)
+       for t in actual.get_tags()])
+
+  def test_sample(self):
+    self.assert_same_as_sequential()
+
+  def test_corpus(self):
+    generate_corpus(jlogger.get_data_file(), num_entries=500)
+    self.assert_same_as_sequential()
+
+  def test_split_chunks(self):
+    data = SAMPLE.encode()
+    chunks = parser.split_chunks(data, 3)
+    self.assertEqual(0, chunks[0][0])
+    self.assertEqual(len(data), chunks[-1][1])
+    for start, _ in chunks[1:]:
+      self.assertIsNotNone(parser.ENTRY_RE.match(data[start:].decode()))
+
+class SnapshotTest(LoggerTestCase):
+  def load_without_parsing(self):
+    iter_entries = parser.iter_entries
+    def fail(lines):
+      raise AssertionError('Data file was parsed')
+    parser.iter_entries = fail
+    try:
+      return jlogger.Logger(use_snapshot=True)
+    finally:
+      parser.iter_entries = iter_entries
+
+  def test_warm_load_uses_snapshot(self):
+    cold = jlogger.Logger(use_snapshot=True)
+    self.assertTrue(os.path.isfile(snapshot.get_snapshot_file(jlogger.get_data_file())))
+
+    warm = self.load_without_parsing()
+    self.assertEqual([str(e) for e in cold.get_entries()],
+                     [str(e) for e in warm.get_entries()])
+    self.assertEqual([e.line_num for e in cold.get_entries()],
+                     [e.line_num for e in warm.get_entries()])
+
+  def test_changed_file_is_reparsed(self):
+    jlogger.Logger(use_snapshot=True)
+    self.write_data(SAMPLE.replace('Dune', 'Emma'))
+    logger = jlogger.Logger(use_snapshot=True)
+    self.assertEqual(['Emma'], logger.get_entry_by_id(4).content)
+
+  def test_version_mismatch_is_ignored(self):
+    jlogger.Logger(use_snapshot=True)
+    orig_version = snapshot.FORMAT_VERSION
+    snapshot.FORMAT_VERSION += 1
+    try:
+      self.assertIsNone(snapshot.load(jlogger.get_data_file()))
+    finally:
+      snapshot.FORMAT_VERSION = orig_version
+
+def create_entries(data_path, n):
+  jlogger.DATA_PATH = data_path
+  shared = SharedLogger()
+  for i in range(n):
+    shared.mutate(lambda logger: logger.create_entry('Entry %d' % i, 5),
+                  retries=100)
+
+class ConcurrencyTest(LoggerTestCase):
+  def test_conflicting_save_raises(self):
+    a, b = jlogger.Logger(), jlogger.Logger()
+    a.create_entry('From a', 5)
+    a.save()
+    b.create_entry('From b', 5)
+    with self.assertRaises(jlogger.ConflictError):
+      b.save()
+
+  def test_compaction_keeps_records_from_other_writers(self):
+    a = jlogger.Logger()
+    a.delete_entry(1)
+    a.save()
+    text, offset = a.prepare_compaction()
+
+    b = jlogger.Logger()
+    b.delete_entry(2)
+    b.save()
+
+    a.commit_compaction(a.write_data_file(text), offset)
+    self.assertTrue(a.is_stale())
+    self.assertEqual([3, 4], sorted(jlogger.Logger().entries_by_id))
+
+  def test_compaction_conflict(self):
+    a, b = jlogger.Logger(), jlogger.Logger()
+    b.compact()
+    text, offset = a.prepare_compaction()
+    with self.assertRaises(jlogger.ConflictError):
+      a.commit_compaction(a.write_data_file(text), offset)
+    self.assertEqual(
+      sorted([jlogger.FILENAME, os.path.basename(jlogger.get_lock_file())]),
+      sorted(os.listdir(self.data_path)))
+
+  def test_concurrent_processes(self):
+    processes = [
+      multiprocessing.Process(target=create_entries, args=(self.data_path, 10))
+      for _ in range(4)
+    ]
+    for p in processes:
+      p.start()
+    for p in processes:
+      p.join()
+
+    logger = jlogger.Logger()
+    self.assertEqual(44, len(logger.entries_by_id))
+
+class LazyContentTest(LoggerTestCase):
+  def assert_same_entries(self, expected, actual):
+    self.assertEqual(
+      [(str(e), e.line_num) for e in expected.get_entries()],
+      [(str(e), e.line_num) for e in actual.get_entries()])
+
+  def test_lazy_load(self):
+    logger = jlogger.Logger(lazy=True)
+    self.assert_same_entries(jlogger.Logger(), logger)
+    self.assertEqual(['Use docker compose up -d', 'to start services.'],
+                     logger.get_entry_by_id(2).content)
+
+  def test_offset_index(self):
+    jlogger.Logger(use_snapshot=True, lazy=True)
+    self.assertTrue(os.path.isfile(
+      snapshot.get_snapshot_file(jlogger.get_data_file(), lazy=True)))
+
+    logger = jlogger.Logger(use_snapshot=True, lazy=True)
+    self.assertEqual(0, logger.content_store.misses)
+    self.assert_same_entries(jlogger.Logger(), logger)
+
+  def test_edit_and_compact(self):
+    logger = jlogger.Logger(lazy=True)
+    logger.edit_entry({'id': 2, 'content': 'Replaced'})
+    logger.compact()
+    self.assertEqual(['Replaced'], jlogger.Logger(lazy=True).get_entry_by_id(2).content)
+    self.assertEqual(['Dune'], logger.get_entry_by_id(4).content)
+
+  def test_content_store_lru(self):
+    with open(jlogger.get_data_file(), 'rb') as f:
+      store = ContentStore(f, capacity=1)
+    span = parser.pack_span(0, 10)
+    first = store.get(span)
+    self.assertIs(first, store.get(span))
+    store.get(parser.pack_span(10, 20))
+    self.assertIsNot(first, store.get(span))
+    self.assertEqual((1, 3), (store.hits, store.misses))
+
+class SharedLoggerTest(LoggerTestCase):
+  def test_reuses_instance_until_file_changes(self):
+    shared = SharedLogger()
+    with shared.acquire() as logger:
+      first = logger
+      logger.create_entry('New entry', 5)
+      logger.save()
+
+    with shared.acquire() as logger:
+      self.assertIs(first, logger)
+      self.assertEqual(5, len(logger.entries_by_id))
+
+    self.write_data(SAMPLE.replace('Dune', 'Emma'))
+    with shared.acquire() as logger:
+      self.assertIsNot(first, logger)
+      self.assertEqual(5, len(logger.entries_by_id))
+      self.assertEqual(['Emma'], logger.get_entry_by_id(4).content)
+
+  def test_compact(self):
+    shared = SharedLogger()
+    with shared.acquire() as logger:
+      logger.create_entry('New entry', 5)
+      logger.save()
+    shared.compact()
+
+    self.assertIn('New entry', self.read_data())
+    with shared.acquire() as logger:
+      self.assertIs(shared.logger, logger)
+      self.assertEqual(0, journal.size(jlogger.get_data_file()))
+
+  def test_failed_mutation_discards_instance(self):
+    shared = SharedLogger()
+    with self.assertRaises(Exception):
+      with shared.acquire() as logger:
+        logger.get_tag_by_id(999)
+    self.assertIsNone(shared.logger)
+
+@unittest.skipIf(django is None, 'Django is not installed')
+class ViewTest(LoggerTestCase):
+  @classmethod
+  def setUpClass(cls):
+    # Imported here: unittest.main inspects module attributes, which would
+    # touch the unconfigured settings.
+    from django.conf import settings
+    if not settings.configured:
+      settings.configure(INSTALLED_APPS=[
+        'django.contrib.auth', 'django.contrib.contenttypes',
+        'rest_framework'])
+      django.setup()
+
+  def get(self, view, pk=None, **params):
+    from rest_framework.test import APIRequestFactory
+    from logger.cache import shared_logger
+    from website import views
+    shared_logger.invalidate()
+    kwargs = {} if pk is None else {'pk': pk}
+    response = getattr(views, view).as_view()(
+      APIRequestFactory().get('/', params), **kwargs)
+    response.render()
+    return response
+
+  def test_paged(self):
+    page = self.get('EntryViewSet', limit=3).data
+    self.assertEqual([4, 3, 2], [e['id'] for e in page['entries']])
+    page = self.get('EntryViewSet', limit=3, cursor=page['cursor']).data
+    self.assertEqual([1], [e['id'] for e in page['entries']])
+    self.assertIsNone(page['cursor'])
+
+  def test_all(self):
+    self.assertEqual([1, 2, 3, 4],
+                     [e['id'] for e in self.get('EntryViewSet').data])
+
+  def test_by_id(self):
+    self.assertEqual('Docker compose',
+                     self.get('EntryViewSet', 2).data['title'].strip())
+    self.assertEqual(404, self.get('EntryViewSet', 99).status_code)
+    self.assertEqual('docker', self.get('TagViewSet', 4).data['name'])
+    self.assertEqual(404, self.get('TagViewSet', 99).status_code)
+
+  def test_tags(self):
+    self.assertEqual({0, 1, 2, 3, 4, 5},
+                     {t['id'] for t in self.get('TagViewSet').data})
+
+class ShardTest(LoggerTestCase):
+  def entry_ids(self, logger):
+    return sorted(logger.entries_by_id)
+
+  def test_round_trip(self):
+    jlogger.Logger().convert('tag')
+    self.assertFalse(os.path.exists(jlogger.get_data_file()))
+    # Nothing the file syncer would upload.
+    self.assertEqual([], [f for f in os.listdir(self.data_path)
+                          if not f.startswith('.')])
+    manifest = shards.read_manifest(jlogger.get_shards_dir())
+    self.assertEqual(['books', 'other', 'programming'],
+                     [s['key'] for s in manifest['shards']])
+
+    logger = jlogger.Logger()
+    self.assertEqual([1, 2, 3, 4], self.entry_ids(logger))
+    self.assertEqual(2, logger.get_tag_by_name('programming').total_entries)
+
+    logger.convert()
+    self.assertFalse(os.path.exists(jlogger.get_shards_dir()))
+    self.assertEqual(SAMPLE, self.read_data())
+
+  def test_load_by_tag(self):
+    jlogger.Logger().convert('tag')
+    logger = jlogger.Logger(tags=['python'])
+    self.assertEqual([1, 2], self.entry_ids(logger))
+    self.assertEqual([4], self.entry_ids(jlogger.Logger(tags=['books'])))
+    with self.assertRaises(Exception):
+      logger.compact()
+
+  def test_load_latest(self):
+    self.write_data(SAMPLE.replace('2020-01-06', '2020-02-06'))
+    jlogger.Logger().convert('month')
+    self.assertEqual([4], self.entry_ids(jlogger.Logger(latest=1)))
+
+    # Only the shards holding the two latest entries are read.
+    jlogger.Logger().convert('tag')
+    self.assertEqual([3, 4], self.entry_ids(jlogger.Logger(latest=2)))
+
+  def test_journal_and_compaction(self):
+    jlogger.Logger().convert('tag')
+    logger = jlogger.Logger(tags=['books'])
+    logger.create_entry('New entry', 5)
+    logger.save()
+
+    logger = jlogger.Logger()
+    self.assertEqual(5, len(logger.entries_by_id))
+    directory = jlogger.get_shards_dir()
+    old_files = set(os.listdir(directory))
+    logger.compact()
+    self.assertEqual(0, journal.size(jlogger.get_data_file()))
+    self.assertFalse(old_files & set(os.listdir(directory)) - {shards.MANIFEST})
+    self.assertEqual(5, len(jlogger.Logger().entries_by_id))
+    self.assertEqual(2, len(jlogger.Logger(tags=['books']).entries_by_id))
+
+class SearchTest(LoggerTestCase):
+  def test_write_vocab(self):
+    counter = suite.count_tokens(jlogger.Logger().get_entries())
+    self.assertEqual(2, counter['docker'])
+    path = os.path.join(self.data_path, 'vocab.txt')
+    search.write_vocab(path, counter)
+    with open(path) as f:
+      lines = f.read().splitlines()
+    self.assertIn('docker 2', lines)
+    counts = [int(line.split()[1]) for line in lines]
+    self.assertEqual(sorted(counts, reverse=True), counts)
+
+class SearchIndexTest(LoggerTestCase):
+  def open_index(self, logger):
+    index = search.SearchIndex(search.get_index_file(jlogger.get_data_file()))
+    self.addCleanup(index.close)
+    index.sync(logger)
+    return index
+
+  # Postings and totals of an index built from scratch over logger.
+  def assert_rebuilt(self, index, logger):
+    with tempfile.TemporaryDirectory() as tmp:
+      with search.SearchIndex(os.path.join(tmp, 'index')) as rebuilt:
+        rebuilt.sync(logger)
+        self.assertEqual(rebuilt.get_totals(), index.get_totals())
+        self.assertEqual(rebuilt.get_vocab(), index.get_vocab())
+        for term in rebuilt.get_vocab():
+          self.assertEqual(rebuilt.get_postings(term), index.get_postings(term))
+
+  def test_query(self):
+    logger = jlogger.Logger()
+    index = self.open_index(logger)
+    self.assertEqual([2], [i for _, i in index.query(['docker'])])
+    self.assertEqual([], index.query(['docker'], entry_ids=[1]))
+    self.assertEqual([], index.query(['nonexistent']))
+    self.assertEqual({2: 2}, index.get_postings('docker'))
+
+  def test_sync_is_incremental(self):
+    logger = jlogger.Logger()
+    index = self.open_index(logger)
+    self.assertEqual(0, index.sync(logger))
+
+    entry = logger.create_entry('Kubernetes', 1)
+    logger.edit_entry({'id': entry.id, 'content': 'docker docker cluster'})
+    logger.delete_entry(1)
+    logger.save()
+    self.assertEqual(2, index.sync(logger))
+    self.assertIn(entry.id, index.get_postings('docker'))
+    self.assertNotIn(1, [i for _, i in index.query(['python'])])
+    self.assert_rebuilt(index, jlogger.Logger())
+
+  # Edits made in vim keep the modification time of the entries.
+  def test_sync_external_edit(self):
+    index = self.open_index(jlogger.Logger())
+    self.write_data(SAMPLE.replace('Use docker compose', 'Nothing to see'))
+    self.assertEqual(1, index.sync(jlogger.Logger()))
+    self.assertEqual({2: 1}, index.get_postings('docker'))
+    self.assertEqual(1, index.get_postings('nothing')[2])
+
+  # Changes saved to the journal are found without reading every entry.
+  def test_sync_journal_only(self):
+    index = self.open_index(jlogger.Logger(lazy=True))
+    logger = jlogger.Logger(lazy=True)
+    logger.edit_entry({'id': 2, 'content': 'Nothing to see'})
+    logger.save()
+
+    checksummed = []
+    get_checksum = search.get_checksum
+    def record(entry):
+      checksummed.append(entry.id)
+      return get_checksum(entry)
+    search.get_checksum = record
+    try:
+      self.assertEqual(1, index.sync(jlogger.Logger(lazy=True)))
+    finally:
+      search.get_checksum = get_checksum
+    self.assertEqual([2], checksummed)
+    self.assertEqual(1, index.get_postings('nothing')[2])
+    self.assert_rebuilt(index, jlogger.Logger())
+
+  # The counts written by the vocab command.
+  def test_get_vocab(self):
+    logger = jlogger.Logger()
+    index = self.open_index(logger)
+    logger.edit_entry({'id': 2, 'content': 'docker swarm'})
+    logger.delete_entry(1)
+    logger.save()
+    index.sync(logger)
+    self.assertEqual(dict(suite.count_tokens(logger.get_entries())),
+                     index.get_vocab())
+
+  def test_correct(self):
+    logger = jlogger.Logger()
+    index = self.open_index(logger)
+    self.assertEqual('docker', index.correct('docker'))
+    self.assertEqual('docker', index.correct('dokcer'))
+    self.assertEqual('docker', index.correct('dockerr'))
+    self.assertIsNone(index.correct('xyzzy'))
+
+    # New words become correctable as they are indexed.
+    entry = logger.create_entry('Kubernetes', 1)
+    logger.save()
+    index.sync(logger)
+    self.assertEqual([('kubernetes', 1, 1)], index.get_suggestions('kubernets'))
+
+  def test_parse_query(self):
+    self.assertEqual([('phrase', ['docker', 'compose'], None),
+                      ('term', ['up'], None)],
+                     search.parse_query('"Docker compose" up'))
+    self.assertEqual([('near', ['a', 'b', 'c'], 3), ('near', ['c', 'd'], 1)],
+                     search.parse_query('a NEAR/3 b NEAR/3 c NEAR/1 d'))
+    self.assertEqual([('term', ['near/3x'], None)],
+                     search.parse_query('NEAR/3x'))
+
+  def test_phrase_and_near(self):
+    logger = jlogger.Logger()
+    logger.edit_entry({'id': 4, 'content': 'compose the docker notes'})
+    index = self.open_index(logger)
+    self.assertEqual({2}, index.match_phrase(['docker', 'compose']))
+    self.assertEqual({2}, index.match_phrase(['compose', 'up', '-d']))
+    self.assertEqual(set(), index.match_phrase(['compose', 'docker']))
+    # Phrases do not span the title and the content.
+    self.assertEqual(set(), index.match_phrase(['compose', 'use']))
+    self.assertEqual({2}, index.match_near(['docker', 'up'], 2))
+    self.assertEqual({2, 4}, index.match_near(['compose', 'docker'], 2))
+    self.assertEqual({4}, index.match_near(['compose', 'notes'], 3))
+    self.assertEqual(set(), index.match_near(['compose', 'notes'], 2))
+
+    results = index.search(search.parse_query('"docker compose"'))
+    self.assertEqual([2], [i for _, i in results])
+    results = index.search(search.parse_query('compose NEAR/2 docker'))
+    self.assertEqual([2, 4], sorted(i for _, i in results))
+
+  def test_title_boost(self):
+    logger = jlogger.Logger()
+    logger.edit_entry({'id': 4, 'content': 'decorators decorators decorators'})
+    index = self.open_index(logger)
+    self.assertEqual(4, index.query(['decorators'])[0][1])
+    self.assertEqual(1, index.query(['decorators'], title_boost=3.0)[0][1])
+
+  def test_top_k(self):
+    generate_corpus(jlogger.get_data_file(), num_entries=300, seed=1)
+    logger = jlogger.Logger()
+    index = self.open_index(logger)
+    rnd = random.Random(0)
+    vocab = sorted(index.get_vocab())
+    for i in range(50):
+      terms = rnd.sample(vocab, rnd.randint(1, 4))
+      k = rnd.choice([1, 5, 20])
+      entry_ids = None if i % 3 else rnd.sample(range(300), 100)
+      title_boost = rnd.choice([1.0, search.TITLE_BOOST])
+      self.assertEqual(index.query(terms, entry_ids, title_boost)[:k],
+                       index.query(terms, entry_ids, title_boost, k))
+
+  def test_lazy_results(self):
+    requests = []
+    def fetch(k):
+      requests.append(k)
+      return list(range(25))[:k]
+
+    results = search.LazyResults(fetch, page_size=10)
+    self.assertEqual(10, len(results))
+    self.assertFalse(results.is_complete())
+    self.assertEqual(12, results[12])
+    self.assertEqual([10, 20], requests)
+    self.assertFalse(results.has(25))
+    self.assertTrue(results.is_complete())
+    self.assertEqual([10, 20, 40], requests)
+
+  def test_partial_logger(self):
+    jlogger.Logger().convert('tag')
+    with self.assertRaises(Exception):
+      self.open_index(jlogger.Logger(latest=1))
+
+class TokenizeTest(LoggerTestCase):
+  # The tokenizer before it was compiled into a single expression.
+  def reference_tokenize(self, s):
+    tokens = []
+    for t in re.split(r'\s+', s):
+      if re.match(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\), ]|'
+                  r'(?:%[0-9a-fA-F][0-9a-fA-F]))+', t) is not None:
+        tokens.append(t)
+        continue
+      tokens += re.split(r"\s+|[:=(),.'?]", t.lower())
+    return [t for t in tokens if len(t) > 0]
+
+  def test_tokenize(self):
+    self.assertEqual(['see', 'https://Example.com/a(b)', 'x', 'y'],
+                     tokenize("See  https://Example.com/a(b) x=Y."))
+    self.assertEqual(['a', 'http', '//b'], tokenize('a,http://b'))
+
+    rnd = random.Random(0)
+    alphabet = list("aZ:=(),.'?%/# \t\n") + ['http://', 'https://', 'HTTP://']
+    for _ in range(2000):
+      s = ''.join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 20)))
+      self.assertEqual(self.reference_tokenize(s), tokenize(s))
+
+  def test_token_cache(self):
+    logger = jlogger.Logger()
+    entry = logger.get_entry_by_id(2)
+    tokens = entry.get_tokens()
+    self.assertIn('docker', tokens)
+    tokens.append('modified')
+    self.assertNotIn('modified', entry.get_tokens())
+
+    logger.edit_entry({'id': 2, 'content': 'Kubernetes cluster'})
+    self.assertIn('kubernetes', entry.get_tokens())
+    entry.title = 'Renamed'
+    self.assertEqual(['renamed', 'kubernetes', 'cluster'], entry.get_tokens())
+
+class QueryCacheTest(LoggerTestCase):
+  def get_cache_file(self):
+    return querycache.get_cache_file(jlogger.get_data_file())
+
+  def test_hits_and_misses(self):
+    logger = jlogger.Logger()
+    cache = querycache.QueryCache()
+    calls = []
+    def compute():
+      calls.append(1)
+      return [(1.5, 2)]
+    self.assertEqual([(1.5, 2)], cache.get_or_compute(logger, 'docker', compute))
+    self.assertEqual([(1.5, 2)], cache.get_or_compute(logger, 'docker', compute))
+    self.assertEqual(1, len(calls))
+    stats = cache.stats()
+    self.assertEqual((1, 1, 1), (stats['hits'], stats['misses'],
+                                 stats['entries']))
+
+  def test_mutations_change_version(self):
+    logger = jlogger.Logger()
+    cache = querycache.QueryCache()
+    cache.put(logger, 'docker', [(1.0, 2)])
+    for mutate in [lambda: logger.create_entry('Kubernetes', 4),
+                   lambda: logger.edit_entry({'id': 1, 'title': 'Closures'}),
+                   lambda: logger.delete_entry(1),
+                   lambda: logger.create_tag(5),
+                   lambda: logger.edit_tag({'id': 6, 'name': 'reading'}),
+                   lambda: logger.delete_tag(6)]:
+      version = logger.version
+      mutate()
+      self.assertNotEqual(version, logger.version)
+      self.assertIsNone(cache.get(logger, 'docker'))
+
+    # Loggers loaded from the same data do not share versions.
+    self.assertNotEqual(jlogger.Logger().version, jlogger.Logger().version)
+
+  def test_budget(self):
+    logger = jlogger.Logger()
+    size = len(querycache.pickle.dumps([0] * 10))
+    cache = querycache.QueryCache(budget=3 * size)
+    for i in range(3):
+      cache.put(logger, i, [i] * 10)
+    cache.get(logger, 0)
+    cache.put(logger, 3, [3] * 10)
+    self.assertIsNone(cache.get(logger, 1))
+    self.assertEqual([0] * 10, cache.get(logger, 0))
+    self.assertLessEqual(cache.size, cache.budget)
+
+    # Results larger than the budget are not kept.
+    cache.put(logger, 'large', list(range(1000)))
+    self.assertIsNone(cache.get(logger, 'large'))
+
+  def test_disk(self):
+    logger = jlogger.Logger()
+    with querycache.QueryCache(path=self.get_cache_file()) as cache:
+      cache.put(logger, ('docker', None), [(1.0, 2)])
+
+    with querycache.QueryCache(path=self.get_cache_file()) as cache:
+      self.assertEqual([(1.0, 2)],
+                       cache.get(jlogger.Logger(), ('docker', None)))
+      self.assertEqual(1, cache.disk_hits)
+
+      # Unsaved changes are not on disk, so results only go to memory.
+      logger.create_entry('Kubernetes', 4)
+      cache.put(logger, ('docker', None), [(2.0, 2)])
+      self.assertEqual([(1.0, 2)],
+                       cache.get(jlogger.Logger(), ('docker', None)))
+
+      # Saving changes the signature the results are stored under.
+      logger.save()
+      self.assertIsNone(cache.get(jlogger.Logger(), ('docker', None)))
+
+  def test_disk_budget(self):
+    logger = jlogger.Logger()
+    size = len(querycache.pickle.dumps([0] * 10))
+    with querycache.QueryCache(path=self.get_cache_file(),
+                               disk_budget=2 * size) as cache:
+      for i in range(3):
+        cache.put(logger, i, [i] * 10)
+    with querycache.QueryCache(path=self.get_cache_file()) as cache:
+      self.assertIsNone(cache.get(logger, 0))
+      self.assertEqual([2] * 10, cache.get(logger, 2))
+
+class FuzzyTest(unittest.TestCase):
+  def test_edit_distance(self):
+    self.assertEqual(0, fuzzy.edit_distance('docker', 'docker'))
+    self.assertEqual(1, fuzzy.edit_distance('docker', 'dockers'))
+    self.assertEqual(2, fuzzy.edit_distance('docker', 'dokcer'))
+    self.assertEqual(3, fuzzy.edit_distance('docker', 'python'))
+    self.assertEqual(6, fuzzy.edit_distance('docker', 'python', 10))
+    self.assertEqual(3, fuzzy.edit_distance('', 'abc', 3))
+    self.assertEqual(2, fuzzy.edit_distance('a' * 100, 'b' + 'a' * 98, 5))
+
+  # Matches the dynamic programming definition for every bound.
+  def test_edit_distances(self):
+    def distance(w1, w2):
+      row = list(range(len(w2) + 1))
+      for i, c in enumerate(w1):
+        prev, row = row, [i + 1]
+        for j, d in enumerate(w2):
+          row.append(min(prev[j] + (c != d), prev[j + 1] + 1, row[j] + 1))
+      return row[-1]
+
+    rnd = random.Random(0)
+    words = [''.join(rnd.choice('abc') for _ in range(rnd.randint(0, 70)))
+             for _ in range(40)]
+    for w1 in words:
+      for max_distance in (0, 2, 100):
+        self.assertEqual(
+          [min(distance(w1, w2), max_distance + 1) for w2 in words],
+          fuzzy.edit_distances(w1, words, max_distance))
+
+  # Words within the maximum distance always share a deletion.
+  def test_deletes(self):
+    rnd = random.Random(0)
+    words = [''.join(rnd.choice('abc') for _ in range(rnd.randint(0, 10)))
+             for _ in range(300)]
+    for w1 in words:
+      for w2 in words[:50]:
+        if fuzzy.edit_distance(w1, w2) <= fuzzy.MAX_DISTANCE:
+          self.assertTrue(fuzzy.get_deletes(w1) & fuzzy.get_deletes(w2))
+
+  def test_rank_candidates(self):
+    candidates = [('docker', 3), ('dicker', 5), ('docket', 9), ('python', 9)]
+    self.assertEqual(
+      [('docker', 1, 3), ('docket', 2, 9), ('dicker', 2, 5)],
+      fuzzy.rank_candidates('dockerr', candidates))
+
+class InverseFrequencyTest(LoggerTestCase):
+  def setUp(self):
+    super().setUp()
+    generate_corpus(jlogger.get_data_file(), num_entries=200, seed=3)
+    self.logger = jlogger.Logger()
+    self.terms = ['python', 'index', 'cache']
+
+  def test_matches_score_entries(self):
+    entries = self.logger.get_entries()
+    vocab = suite.count_tokens(entries)
+    expected = suite.score_entries(reversed(entries), self.terms, vocab)
+    with search.SearchIndex(os.path.join(self.data_path, 'index')) as index:
+      index.sync(self.logger)
+      clauses = search.parse_query(' '.join(self.terms))
+      results = dict((i, s) for s, i in index.search(
+        clauses, scorer='inverse_frequency'))
+      top = index.search(clauses, k=5, scorer='inverse_frequency')
+    self.assertEqual({e.id for _, e in expected}, set(results))
+    for score, e in expected:
+      self.assertAlmostEqual(score, results[e.id])
+    self.assertEqual([e.id for _, e in expected[:5]], [i for _, i in top])
+
+class BenchmarkTest(unittest.TestCase):
+  def test_run(self):
+    report = suite.run({'num_entries': 50}, repeat=1, names=['load', 'save'])
+    self.assertEqual(['load', 'save'], sorted(report['results']))
+
+  def test_compare(self):
+    baseline = {'results': {'load': 1.0, 'save': 1.0, 'vocab': 1.0}}
+    report = {'results': {'load': 1.1, 'save': 1.5, 'search': 9.0}}
+    self.assertEqual([('save', 1.0, 1.5, 50.0)],
+                     suite.compare(baseline, report, 20))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -31,6 +31,7 @@ urlpatterns += [
 ]
 
 urlpatterns += [
+    path("tags/complete/", views.complete_tags, name="complete_tags"),
     path("tags/<int:pk>/", views.TagViewSet.as_view(), name="tags"),
     path("tags/", views.TagViewSet.as_view(), name="tags"),
 ]
@@ -7,7 +7,7 @@ from rest_framework.response import Response
 from rest_framework.decorators import action
 from rest_framework.views import APIView
 
-from logger import jlogger
+from logger.cache import shared_logger
 import json
 import datetime
 
@@ -27,9 +27,28 @@ class EntrySerializer(serializers.Serializer):
 class EntryViewSet(APIView):
   serializer_class = EntrySerializer
 
-  def list(self, request):
-    logger = jlogger.Logger()
-    entries = [e.to_json() for e in logger.get_entries()]
+  # With ?limit=n, returns the n most recently modified entries and a cursor
+  # to pass as ?cursor= for the next page. With pk, returns that entry.
+  def get(self, request, pk=None):
+    if pk is not None:
+      with shared_logger.acquire() as logger:
+        e = logger.entries_by_id.get(pk)
+        if e is None:
+          return Response(status=404)
+        serializer = EntrySerializer(instance=e.to_json())
+      return Response(serializer.data)
+
+    if 'limit' in request.GET:
+      cursor = request.GET.get('cursor')
+      with shared_logger.acquire() as logger:
+        entries, cursor = logger.get_latest_entries(
+          int(request.GET['limit']), int(cursor) if cursor else None)
+        entries = [e.to_json() for e in entries]
+      serializer = EntrySerializer(instance=entries, many=True)
+      return Response({'entries': serializer.data, 'cursor': cursor})
+
+    with shared_logger.acquire() as logger:
+      entries = [e.to_json() for e in logger.get_entries()]
     serializer = EntrySerializer(
       instance=entries, many=True)
     return Response(serializer.data)
@@ -37,26 +56,23 @@ class EntryViewSet(APIView):
   def post(self, request):
     body_unicode = request.body.decode('utf-8')
     body = json.loads(body_unicode)
-    logger = jlogger.Logger()
-    e = logger.create_entry(body['title'], body['parent_id'])
-    logger.save()
-    serializer = EntrySerializer(instance=e.to_json())
+    e = shared_logger.mutate(
+      lambda logger: logger.create_entry(body['title'], body['parent_id']).to_json())
+    serializer = EntrySerializer(instance=e)
     return Response(serializer.data)
 
   def patch(self, request):
     body_unicode = request.body.decode('utf-8')
     body = json.loads(body_unicode)
-    logger = jlogger.Logger()
-    e = logger.edit_entry(body)
-    logger.save()
-    serializer = EntrySerializer(instance=e.to_json())
+    e = shared_logger.mutate(
+      lambda logger: logger.edit_entry(body).to_json())
+    serializer = EntrySerializer(instance=e)
     return Response(serializer.data)
 
   def delete(self, request, pk=None):
-    logger = jlogger.Logger()
-    e = logger.delete_entry(int(pk))
-    logger.save()
-    serializer = EntrySerializer(instance=e.to_json())
+    e = shared_logger.mutate(
+      lambda logger: logger.delete_entry(int(pk)).to_json())
+    serializer = EntrySerializer(instance=e)
     return Response(serializer.data)
 
 
@@ -72,9 +88,18 @@ class TagSerializer(serializers.Serializer):
 class TagViewSet(APIView):
   serializer_class = TagSerializer
 
-  def list(self, request):
-    logger = jlogger.Logger()
-    tags = [t.to_json() for t in logger.get_tags()]
+  # With pk, returns that tag.
+  def get(self, request, pk=None):
+    if pk is not None:
+      with shared_logger.acquire() as logger:
+        tag = logger.tags_by_id.get(pk)
+        if tag is None:
+          return Response(status=404)
+        serializer = TagSerializer(instance=tag.to_json())
+      return Response(serializer.data)
+
+    with shared_logger.acquire() as logger:
+      tags = [t.to_json() for t in logger.get_tags()]
     serializer = TagSerializer(
       instance=tags, many=True)
     return Response(serializer.data)
@@ -82,33 +107,36 @@ class TagViewSet(APIView):
   def post(self, request):
     body_unicode = request.body.decode('utf-8')
     body = json.loads(body_unicode)
-    logger = jlogger.Logger()
-    tag = logger.create_tag(body['parent'])
-    logger.save()
-    serializer = TagSerializer(instance=tag.to_json())
+    tag = shared_logger.mutate(
+      lambda logger: logger.create_tag(body['parent']).to_json())
+    serializer = TagSerializer(instance=tag)
     return Response(serializer.data)
 
   def patch(self, request):
     body_unicode = request.body.decode('utf-8')
     body = json.loads(body_unicode)
-    logger = jlogger.Logger()
-    tag = logger.edit_tag(body)
-    logger.save()
-    serializer = TagSerializer(instance=tag.to_json())
+    tag = shared_logger.mutate(
+      lambda logger: logger.edit_tag(body).to_json())
+    serializer = TagSerializer(instance=tag)
     return Response(serializer.data)
 
   def delete(self, request, pk=None):
-    logger = jlogger.Logger()
-    tag = logger.delete_tag(int(pk))
-    logger.save()
-    serializer = TagSerializer(instance=tag.to_json())
+    tag = shared_logger.mutate(
+      lambda logger: logger.delete_tag(int(pk)).to_json())
+    serializer = TagSerializer(instance=tag)
     return Response(serializer.data)
 
 
 def all(request):
-  logger = jlogger.Logger()
-  return JsonResponse({
-    'tags': [t.to_json() for t in logger.get_tags()],
-    'entries': [e.to_json() for e in logger.get_entries()],
-  })
-
+  with shared_logger.acquire() as logger:
+    return JsonResponse({
+      'tags': [t.to_json() for t in logger.get_tags()],
+      'entries': [e.to_json() for e in logger.get_entries()],
+    })
+
+# Names of the tags starting with ?prefix=, at most ?limit= (20 by default).
+def complete_tags(request):
+  prefix = request.GET.get('prefix', '')
+  limit = int(request.GET.get('limit', 20))
+  with shared_logger.acquire() as logger:
+    return JsonResponse({'tags': logger.complete_tag_name(prefix, limit)})